@@ -1,18 +1,34 @@
+import io
 import os
+import json
 import uuid
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, send_file
+import hashlib
+import atexit
+import queue
+import threading
+import tempfile
+import httpx
+from urllib.parse import unquote
+from flask import Flask, Request, Response, g, render_template, request, jsonify, redirect, url_for, session, send_file, stream_with_context
 from werkzeug.utils import secure_filename
+from flask_session import Session
+from flask_compress import Compress
+from cachelib import FileSystemCache, RedisCache
 from anthropic import Anthropic
 from dotenv import load_dotenv
 import logging
-import smtplib
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from email.message import EmailMessage
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 
 # Import utility modules
-from utils.file_processor import extract_text_from_folder, create_docx_from_text
-from utils.prompt_builder import optimize_prompt_for_token_limits, FORMAT_DETAILS
-from utils.cleanup import cleanup_old_files, get_storage_stats
+from utils.file_processor import extract_text_from_folder, extract_text_from_file_cached, create_docx_from_text
+from utils.prompt_builder import optimize_prompt_parts_for_token_limits, dedupe_paragraphs, FORMAT_DETAILS, get_tokenizer
+from utils.cleanup import start_cleanup_thread, get_storage_stats, record_storage_change
+from utils.json_provider import ORJSONProvider
+from utils.smtp_pool import SMTPConnectionPool
+from utils.native_threads import native_thread_pool
 
 # Import configuration
 from config import get_config
@@ -20,14 +36,51 @@ from config import get_config
 # Load environment variables
 load_dotenv()
 
+class UploadRequest(Request):
+    """Request that spools uploaded files onto the uploads volume"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # Werkzeug's default keeps up to 500KB in memory and then spills to the system
+        # temp dir. Spooling next to the final location lets save_upload() link the
+        # file into place instead of copying it.
+        return tempfile.NamedTemporaryFile('wb+', dir=config.UPLOAD_FOLDER, prefix='.upload-')
+
 # Initialize Flask app
 app = Flask(__name__)
+app.request_class = UploadRequest
+app.json = ORJSONProvider(app)
 config = get_config()
 app.config.from_object(config)
 
+# Keep session data server-side so the cookie only carries the session id.
+# Previously generated content is cached alongside, keyed by its prompt.
+if config.SESSION_REDIS_URL:
+    import redis
+    redis_client = redis.Redis.from_url(config.SESSION_REDIS_URL)
+    app.config['SESSION_TYPE'] = 'redis'
+    app.config['SESSION_REDIS'] = redis_client
+    generation_cache = RedisCache(host=redis_client, key_prefix='gen:', default_timeout=config.GENERATION_CACHE_TTL)
+else:
+    app.config['SESSION_TYPE'] = 'cachelib'
+    app.config['SESSION_CACHELIB'] = FileSystemCache(config.SESSION_FOLDER, threshold=config.SESSION_FILE_THRESHOLD)
+    generation_cache = FileSystemCache(config.GENERATION_CACHE_FOLDER, threshold=config.GENERATION_CACHE_THRESHOLD,
+                                       default_timeout=config.GENERATION_CACHE_TTL)
+Session(app)
+Compress(app)
+
+# Create required directories at startup
+def create_directories():
+    """Create all required directories at startup"""
+    # Ensure upload directory exists
+    os.makedirs(config.UPLOAD_FOLDER, exist_ok=True)
+    
+    # Ensure log directory exists
+    os.makedirs(config.LOG_FOLDER, exist_ok=True)
+
+# Call create_directories during initialization
+create_directories()
+
 # Configure logging
-if not os.path.exists(config.LOG_FOLDER):
-    os.makedirs(config.LOG_FOLDER)
 file_handler = RotatingFileHandler(
     config.LOG_FILE, 
     maxBytes=config.LOG_MAX_BYTES, 
@@ -37,46 +90,190 @@ file_handler.setFormatter(logging.Formatter(
     '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
 ))
 file_handler.setLevel(logging.INFO)
-app.logger.addHandler(file_handler)
+
+# Request threads only enqueue log records; a listener thread does the file
+# writes and rotation so request latency never pays for disk I/O
+log_queue = queue.Queue(-1)
+app.logger.addHandler(QueueHandler(log_queue))
+log_listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop)
 app.logger.setLevel(logging.INFO)
 app.logger.info('Writing Assistant startup')
 
-# Initialize Anthropic client
-anthropic = Anthropic(api_key=config.ANTHROPIC_API_KEY)
+# Initialize Anthropic client on a shared HTTP/2 connection pool, so repeated
+# /generate calls reuse an open TLS connection instead of handshaking each time.
+# httpx drops idle connections after 5 seconds by default, which is shorter than
+# the usual gap between generations, so keep them open longer.
+http_client = httpx.Client(
+    http2=True,
+    limits=httpx.Limits(
+        max_keepalive_connections=config.ANTHROPIC_MAX_KEEPALIVE,
+        max_connections=config.ANTHROPIC_MAX_CONNECTIONS,
+        keepalive_expiry=config.ANTHROPIC_KEEPALIVE_EXPIRY
+    ),
+    timeout=httpx.Timeout(config.ANTHROPIC_TIMEOUT, connect=5.0)
+)
+atexit.register(http_client.close)
+anthropic = Anthropic(api_key=config.ANTHROPIC_API_KEY, http_client=http_client)
+PROMPT_CACHING_HEADERS = {"anthropic-beta": "prompt-caching-2024-07-31"}
+
+# Authenticated SMTP connections are reused across /email-result requests
+smtp_pool = SMTPConnectionPool()
+atexit.register(smtp_pool.close_all)
+
+# Result emails are sent off the request thread
+email_executor = ThreadPoolExecutor(max_workers=config.EMAIL_WORKERS, thread_name_prefix='email')
+atexit.register(email_executor.shutdown, wait=True)
+
+# Captured leads are buffered in memory and appended to leads.jsonl in batches
+# by a background thread, every LEAD_FLUSH_SECONDS or once LEAD_FLUSH_BATCH
+# records are waiting. A final flush runs at exit.
+_lead_buffer = []
+_lead_lock = threading.Lock()
+_lead_write_lock = threading.Lock()
+_lead_wakeup = threading.Event()
+_lead_stop = threading.Event()
+
+# Load the tokenizer at startup. Loaded lazily, the first /generate in each worker
+# would download its BPE file (unless bundled via TIKTOKEN_CACHE_DIR) inside the request.
+get_tokenizer()
+
+# Uploaded files are parsed in the background as soon as they land, so the
+# extracted text is already in the text cache when /generate needs it. Parsing
+# is CPU-bound, so it runs on OS threads even under gevent.
+extraction_executor = native_thread_pool(max_workers=2, thread_name_prefix='extract')
+atexit.register(extraction_executor.shutdown, wait=False)
+
+# Upload categories, each with its own subfolder in the session folder
+_CATEGORIES = frozenset({'style', 'past', 'competitive', 'materials'})
+
+# Session ids whose upload folders this process has already created. Bounded,
+# since it only saves a few mkdir calls per request.
+_SESSIONS_READY = set()
+_SESSIONS_READY_MAX = 10000
+
+# Per-category extraction limits (characters) for generation, in prompt order
+_CATEGORY_TEXT_LIMITS = (
+    ('materials', 150000),
+    ('style', 100000),
+    ('past', 50000),
+    ('competitive', 50000),
+)
+
+# Read size for raw-body uploads
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Allowed upload extensions, normalised once for O(1) lookups
+_ALLOWED_EXTENSIONS = frozenset(ext.lower() for ext in config.ALLOWED_EXTENSIONS)
 
 # Helper functions
 def allowed_file(filename):
     """Check if a filename has an allowed extension"""
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in config.ALLOWED_EXTENSIONS
+    _, dot, ext = filename.rpartition('.')
+    return bool(dot) and ext.lower() in _ALLOWED_EXTENSIONS
+
+def save_upload(file, file_path):
+    """Save an uploaded file, hard-linking its spool file into place when possible"""
+    spool_path = getattr(file.stream, 'name', None)
+    if isinstance(spool_path, str):
+        try:
+            file.stream.flush()
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            os.link(spool_path, file_path)
+            return
+        except OSError as e:
+            app.logger.warning(f"Could not link upload into place, copying instead: {str(e)}")
+    
+    file.save(file_path)
+
+def existing_file_size(file_path):
+    """Return the size of a file, or None if it does not exist"""
+    try:
+        return os.stat(file_path).st_size
+    except FileNotFoundError:
+        return None
+
+def record_file_saved(file_path, previous_size):
+    """Update the storage stats for a session file that was just saved, possibly replacing a file of previous_size bytes"""
+    size = os.stat(file_path).st_size
+    if previous_size is None:
+        record_storage_change(config.UPLOAD_FOLDER, session['session_id'], size, 1)
+    else:
+        record_storage_change(config.UPLOAD_FOLDER, session['session_id'], size - previous_size, 0)
+
+def write_generated_content(content_file, content):
+    """Write generated content to the session's content file and update the storage stats"""
+    previous_size = existing_file_size(content_file)
+    try:
+        f = open(content_file, 'w', encoding='utf-8')
+    except FileNotFoundError:
+        # Cleanup removed this expired session's folder; recreate it, and have the
+        # next request recreate its category folders too
+        session_folder = os.path.dirname(content_file)
+        _SESSIONS_READY.discard(os.path.basename(session_folder))
+        os.makedirs(session_folder, exist_ok=True)
+        record_storage_change(config.UPLOAD_FOLDER, session['session_id'], 0, 0)
+        f = open(content_file, 'w', encoding='utf-8')
+    with f:
+        f.write(content)
+    record_file_saved(content_file, previous_size)
+
+def category_is_full(category_folder):
+    """Check whether a category folder holds the maximum number of files, stopping the scan at the cap"""
+    existing_count = 0
+    try:
+        entries = os.scandir(category_folder)
+    except FileNotFoundError:
+        # Cleanup removed this expired session after its folders were created
+        os.makedirs(category_folder, exist_ok=True)
+        return False
+    with entries:
+        for _ in entries:
+            existing_count += 1
+            if existing_count >= config.MAX_FILES_PER_CATEGORY:
+                return True
+    return False
+
+def set_session_value(key, value):
+    """Store a value in the session only if it changed, so unchanged sessions are not rewritten"""
+    if session.get(key) != value:
+        session[key] = value
 
 def get_session_folder():
     """Get or create a unique session folder for file uploads"""
+    # Resolved once per request
+    if 'session_folder' in g:
+        return g.session_folder
+    
     if 'session_id' not in session:
         session['session_id'] = str(uuid.uuid4())
     
-    session_folder = os.path.join(config.UPLOAD_FOLDER, session['session_id'])
-    if not os.path.exists(session_folder):
-        os.makedirs(session_folder)
-        # Create subdirectories for each upload category
-        os.makedirs(os.path.join(session_folder, 'style'))
-        os.makedirs(os.path.join(session_folder, 'past'))
-        os.makedirs(os.path.join(session_folder, 'competitive'))
-        os.makedirs(os.path.join(session_folder, 'materials'))
+    session_id = session['session_id']
+    session_folder = os.path.join(config.UPLOAD_FOLDER, session_id)
+    # Create subdirectories for each upload category, once per session per process
+    if session_id not in _SESSIONS_READY:
+        if not os.path.isdir(session_folder):
+            record_storage_change(config.UPLOAD_FOLDER, session_id, 0, 0)
+        for category in _CATEGORIES:
+            os.makedirs(os.path.join(session_folder, category), exist_ok=True)
+        if len(_SESSIONS_READY) >= _SESSIONS_READY_MAX:
+            _SESSIONS_READY.clear()
+        _SESSIONS_READY.add(session_id)
     
+    g.session_folder = session_folder
     return session_folder
 
 # Routes
 @app.route('/')
 def index():
     """Render the main page"""
-    # Clean up old files on page load (could be moved to a scheduled task)
-    cleanup_old_files(config.UPLOAD_FOLDER, config.FILE_RETENTION_DAYS)
-
     # Capture UTM params for lead attribution
     utm_keys = ['utm_source', 'utm_medium', 'utm_campaign', 'utm_term', 'utm_content']
     utms = {k: request.args.get(k) for k in utm_keys if request.args.get(k)}
     if utms:
-        session['utms'] = utms
+        set_session_value('utms', utms)
         app.logger.info(f"Captured UTMs: {utms}")
 
     return render_template('index.html')
@@ -84,7 +281,7 @@ def index():
 @app.route('/upload/<category>', methods=['POST'])
 def upload_file(category):
     """Handle file uploads for a specific category"""
-    if category not in ['style', 'past', 'competitive', 'materials']:
+    if category not in _CATEGORIES:
         return jsonify({'error': 'Invalid category'}), 400
     
     # Check if the post request has the file part
@@ -104,14 +301,16 @@ def upload_file(category):
         category_folder = os.path.join(session_folder, category)
         
         # Check if maximum files per category is reached
-        existing_files = os.listdir(category_folder)
-        if len(existing_files) >= config.MAX_FILES_PER_CATEGORY:
+        if category_is_full(category_folder):
             return jsonify({'error': f'Maximum {config.MAX_FILES_PER_CATEGORY} files allowed per category'}), 400
         
         # Save the file
         filename = secure_filename(file.filename)
         file_path = os.path.join(category_folder, filename)
-        file.save(file_path)
+        previous_size = existing_file_size(file_path)
+        save_upload(file, file_path)
+        record_file_saved(file_path, previous_size)
+        extraction_executor.submit(extract_text_from_file_cached, file_path, config.TEXT_CACHE_FOLDER)
         
         return jsonify({
             'success': True,
@@ -121,10 +320,57 @@ def upload_file(category):
     
     return jsonify({'error': 'File type not allowed'}), 400
 
+@app.route('/upload-stream/<category>', methods=['POST'])
+def upload_file_stream(category):
+    """Handle a raw-body file upload, copying the request stream straight to disk"""
+    if category not in _CATEGORIES:
+        return jsonify({'error': 'Invalid category'}), 400
+    
+    # The filename travels in a header, URI-encoded by the client
+    filename = secure_filename(unquote(request.headers.get('X-Filename', '')))
+    if not filename:
+        return jsonify({'error': 'No selected file'}), 400
+    
+    if not allowed_file(filename):
+        return jsonify({'error': 'File type not allowed'}), 400
+    
+    session_folder = get_session_folder()
+    category_folder = os.path.join(session_folder, category)
+    
+    # Check if maximum files per category is reached
+    if category_is_full(category_folder):
+        return jsonify({'error': f'Maximum {config.MAX_FILES_PER_CATEGORY} files allowed per category'}), 400
+    
+    # Copy into a spool file outside the category folder and rename it into
+    # place once complete, so a partial upload is never listed or extracted.
+    # request.stream enforces MAX_CONTENT_LENGTH.
+    file_path = os.path.join(category_folder, filename)
+    fd, spool_path = tempfile.mkstemp(dir=session_folder, prefix='.upload-')
+    try:
+        with open(fd, 'wb', buffering=0) as dst:
+            while True:
+                chunk = request.stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                dst.write(chunk)
+        previous_size = existing_file_size(file_path)
+        os.replace(spool_path, file_path)
+    except BaseException:
+        os.remove(spool_path)
+        raise
+    record_file_saved(file_path, previous_size)
+    extraction_executor.submit(extract_text_from_file_cached, file_path, config.TEXT_CACHE_FOLDER)
+    
+    return jsonify({
+        'success': True,
+        'filename': filename,
+        'category': category
+    })
+
 @app.route('/files/<category>', methods=['GET'])
 def get_files(category):
     """Get list of uploaded files for a category"""
-    if category not in ['style', 'past', 'competitive', 'materials']:
+    if category not in _CATEGORIES:
         return jsonify({'error': 'Invalid category'}), 400
     
     session_folder = get_session_folder()
@@ -132,30 +378,30 @@ def get_files(category):
     
     files = []
     if os.path.exists(category_folder):
-        files = os.listdir(category_folder)
+        with os.scandir(category_folder) as entries:
+            files = [entry.name for entry in entries if entry.is_file()]
     
     return jsonify({'files': files})
 
 @app.route('/delete/<category>/<filename>', methods=['DELETE'])
 def delete_file(category, filename):
     """Delete an uploaded file"""
-    if category not in ['style', 'past', 'competitive', 'materials']:
+    if category not in _CATEGORIES:
         return jsonify({'error': 'Invalid category'}), 400
     
     session_folder = get_session_folder()
     file_path = os.path.join(session_folder, category, secure_filename(filename))
     
-    if os.path.exists(file_path):
+    size = existing_file_size(file_path)
+    if size is not None:
         os.remove(file_path)
+        record_storage_change(config.UPLOAD_FOLDER, session['session_id'], -size, -1)
         return jsonify({'success': True})
     
     return jsonify({'error': 'File not found'}), 404
 
-@app.route('/generate', methods=['POST'])
-def generate_content():
-    """Generate content using Anthropic API"""
-    # Get form data
-    data = request.form
+def build_generation_prompt(data, session_folder):
+    """Build the Claude system blocks and user message from the submitted form data and uploaded materials"""
     brief = data.get('brief', '')
     # No explicit format selector in UI; default to 'custom'
     format_type = data.get('format') or 'custom'
@@ -175,35 +421,39 @@ def generate_content():
     # Optional pasted text (in addition to uploads)
     materials_paste = data.get('materials_paste')
     
-    if not brief:
-        return jsonify({'error': 'Brief is required'}), 400
-    # format_type now inferred/defaulted to 'custom'
-    
-    # Get session folder
-    session_folder = get_session_folder()
-    
     # Extract text from uploaded files with size limits to prevent memory issues
-    # Set reasonable limits for each category based on their importance
-    materials_text_files = extract_text_from_folder(os.path.join(session_folder, 'materials'), max_chars=150000)
+    # Set reasonable limits for each category based on their importance.
+    # The categories are extracted concurrently; the legacy folders are usually empty.
+    with native_thread_pool(max_workers=len(_CATEGORY_TEXT_LIMITS)) as executor:
+        futures = {
+            category: executor.submit(extract_text_from_folder, os.path.join(session_folder, category),
+                                      max_chars=max_chars, text_cache_folder=config.TEXT_CACHE_FOLDER)
+            for category, max_chars in _CATEGORY_TEXT_LIMITS
+        }
+    extracted = {category: future.result() for category, future in futures.items()}
+
+    materials_text_files = extracted['materials']
     if not materials_text_files:
         # Backward compatibility: fall back to previous category folders if materials is empty
-        style_text_files = extract_text_from_folder(os.path.join(session_folder, 'style'), max_chars=100000)
-        past_text_files = extract_text_from_folder(os.path.join(session_folder, 'past'), max_chars=50000)
-        competitive_text_files = extract_text_from_folder(os.path.join(session_folder, 'competitive'), max_chars=50000)
-        materials_text_files = "\n\n".join(filter(None, [style_text_files, past_text_files, competitive_text_files]))
+        materials_text_files = "\n\n".join(filter(None, [extracted['style'], extracted['past'], extracted['competitive']]))
 
     # Merge pasted text (if any) with extracted text from files
     materials_text = ((materials_paste.strip() + "\n\n") if materials_paste else "") + (materials_text_files or "")
     
+    # Drop paragraphs repeated across uploads (e.g. several drafts of the same document)
+    raw_size = len(materials_text)
+    materials_text = dedupe_paragraphs(materials_text)
+    
     # Log source material size for debugging
-    app.logger.info(f"Source material size - Materials: {len(materials_text)} chars")
+    app.logger.info("Source material size - Materials: %d chars (%d before removing duplicate paragraphs)",
+                    len(materials_text), raw_size)
     
     # Calculate total size for additional logging
     total_size = len(materials_text)
-    app.logger.info(f"Total source material size: {total_size} characters")
+    app.logger.info("Total source material size: %d characters", total_size)
     
-    # Construct optimized prompt for Claude
-    prompt = optimize_prompt_for_token_limits(
+    # Construct optimized prompt for Claude, with the source material in a cacheable system block
+    system_blocks, user_message = optimize_prompt_parts_for_token_limits(
         brief,
         format_type,
         materials_text,
@@ -222,62 +472,183 @@ def generate_content():
         persona=persona
     )
 
+    # Log the request parameters
+    app.logger.info("Generating content with model: %s", config.CLAUDE_MODEL)
+    app.logger.info("Brief length: %d characters", len(brief))
+    app.logger.info("Format: %s", format_type)
+
+    return system_blocks, user_message
+
+def build_message_params(system_blocks, user_message):
+    """Build the Messages API arguments, keeping the cached source material in the system prompt"""
+    params = {
+        'model': config.CLAUDE_MODEL,
+        'max_tokens': config.MAX_TOKENS,
+        'messages': [
+            {
+                "role": "user",
+                "content": user_message
+            }
+        ]
+    }
+    if system_blocks:
+        params['system'] = system_blocks
+    return params
+
+def generation_cache_key(message_params):
+    """Content-address a generation by model, token limit and the full prompt"""
+    payload = json.dumps(message_params, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def log_usage(usage):
+    """Log token usage, including prompt cache writes and hits"""
+    app.logger.info(
+        "Token usage - input: %s, output: %s, cache write: %s, cache read: %s",
+        usage.input_tokens,
+        usage.output_tokens,
+        getattr(usage, 'cache_creation_input_tokens', None) or 0,
+        getattr(usage, 'cache_read_input_tokens', None) or 0
+    )
+
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+def sse_event(payload):
+    """Frame a JSON payload as a server-sent event"""
+    return f"data: {json.dumps(payload)}\n\n"
+
+@app.route('/generate', methods=['POST'])
+def generate_content():
+    """Generate content using Anthropic API"""
+    # Get form data
+    data = request.form
+    
+    if not data.get('brief'):
+        return jsonify({'error': 'Brief is required'}), 400
+    # format_type now inferred/defaulted to 'custom'
+    
+    # Get session folder
+    session_folder = get_session_folder()
+    
+    message_params = build_message_params(*build_generation_prompt(data, session_folder))
+    cache_key = generation_cache_key(message_params)
 
     try:
-        # Log the request parameters
-        app.logger.info(f"Generating content with model: {config.CLAUDE_MODEL}")
-        app.logger.info(f"Brief length: {len(brief)} characters")
-        app.logger.info(f"Format: {format_type}")
-        
         # Call Anthropic API - updated for version 0.45.2
         try:
-            response = anthropic.messages.create(
-                model=config.CLAUDE_MODEL,
-                max_tokens=config.MAX_TOKENS,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ]
-            )
-            
-            # Log successful API call
-            app.logger.info("Anthropic API call successful")
-            
-            # Extract content from the response
-            generated_content = response.content[0].text
-            
-            # Log the size of the generated content
-            app.logger.info(f"Generated content size: {len(generated_content)} characters")
-            
-            # Create a file to store the content instead of using the session
-            content_file = os.path.join(session_folder, 'generated_content.txt')
-            with open(content_file, 'w', encoding='utf-8') as f:
-                f.write(generated_content)
-            
-            # Store only the file path in the session, not the entire content
-            session['content_file_path'] = content_file
-            
-            return jsonify({
-                'success': True,
-                'content': generated_content
-            })
+            # Identical prompts reuse the previous generation without an API call
+            generated_content = generation_cache.get(cache_key)
+            if generated_content is not None:
+                app.logger.info("Serving generated content from cache")
+            else:
+                response = anthropic.messages.create(**message_params, extra_headers=PROMPT_CACHING_HEADERS)
+                
+                # Log successful API call
+                app.logger.info("Anthropic API call successful")
+                log_usage(response.usage)
+                
+                # Extract content from the response
+                generated_content = response.content[0].text
+                generation_cache.set(cache_key, generated_content)
         except Exception as api_error:
             # Log detailed API error
-            app.logger.error(f"Anthropic API error details: {type(api_error).__name__}: {str(api_error)}")
-            if hasattr(api_error, '__dict__'):
-                app.logger.error(f"API error attributes: {str(api_error.__dict__)}")
+            app.logger.error("Anthropic API error details: %s: %s", type(api_error).__name__, api_error)
+            if hasattr(api_error, '__dict__') and app.logger.isEnabledFor(logging.DEBUG):
+                app.logger.debug("API error attributes: %s", api_error.__dict__)
             
             # Re-raise to be caught by the outer try-except
             raise
+        
+        # Log the size of the generated content
+        app.logger.info("Generated content size: %d characters", len(generated_content))
+        
+        # Create a file to store the content instead of using the session
+        content_file = os.path.join(session_folder, 'generated_content.txt')
+        write_generated_content(content_file, generated_content)
+        
+        # Store only the file path in the session, not the entire content
+        set_session_value('content_file_path', content_file)
+        
+        return jsonify({
+            'success': True,
+            'content': generated_content
+        })
     except Exception as e:
-        app.logger.error(f"Error generating content: {type(e).__name__}: {str(e)}")
+        app.logger.error("Error generating content: %s: %s", type(e).__name__, e)
         # Return a proper JSON response with error details
         error_response = {'error': f'Error generating content: {str(e)}'}
-        app.logger.info(f"Returning error response: {error_response}")
+        app.logger.info("Returning error response: %s", error_response)
         return jsonify(error_response), 500
 
+@app.route('/generate-stream', methods=['POST'])
+def generate_content_stream():
+    """Generate content using Anthropic API, streaming tokens as server-sent events"""
+    data = request.form
+    
+    if not data.get('brief'):
+        return jsonify({'error': 'Brief is required'}), 400
+    
+    session_folder = get_session_folder()
+    message_params = build_message_params(*build_generation_prompt(data, session_folder))
+    cache_key = generation_cache_key(message_params)
+    
+    # The session cookie goes out with the response headers, before the body is
+    # streamed, so record the content file path up front
+    content_file = os.path.join(session_folder, 'generated_content.txt')
+    set_session_value('content_file_path', content_file)
+    
+    def generate():
+        chunks = []
+        try:
+            # Identical prompts replay the previous generation without an API call
+            cached_content = generation_cache.get(cache_key)
+            if cached_content is not None:
+                app.logger.info("Serving generated content from cache")
+                write_generated_content(content_file, cached_content)
+                yield sse_event({'delta': cached_content})
+                yield sse_event({'done': True})
+                return
+            
+            with anthropic.messages.stream(**message_params, extra_headers=PROMPT_CACHING_HEADERS) as stream:
+                for text in stream.text_stream:
+                    chunks.append(text)
+                    yield sse_event({'delta': text})
+                log_usage(stream.get_final_message().usage)
+            
+            generated_content = ''.join(chunks)
+            app.logger.info("Streamed content size: %d characters", len(generated_content))
+            
+            write_generated_content(content_file, generated_content)
+            generation_cache.set(cache_key, generated_content)
+            
+            yield sse_event({'done': True})
+        except Exception as e:
+            app.logger.error("Error streaming content: %s: %s", type(e).__name__, e)
+            yield sse_event({'error': f'Error generating content: {str(e)}'})
+    
+    # Tell browsers and reverse proxies (nginx, Render's edge) not to cache or
+    # buffer the stream, otherwise tokens arrive in bursts instead of as generated
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers=SSE_HEADERS)
+
+@lru_cache(maxsize=64)
+def _read_content(file_path, mtime_ns, size):
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+def read_generated_content(file_path):
+    """Read a generated content file, reusing the previous read while the file is unchanged"""
+    stat = os.stat(file_path)
+    return _read_content(file_path, stat.st_mtime_ns, stat.st_size)
+
+@lru_cache(maxsize=32)
+def build_docx_bytes(content):
+    """Convert generated content to DOCX bytes, memoized so repeat downloads skip python-docx"""
+    docx_file = create_docx_from_text(content)
+    if not docx_file:
+        return None
+    with docx_file:
+        return docx_file.read()
+
 @app.route('/result')
 def result():
     """Display the generated content"""
@@ -288,8 +659,7 @@ def result():
         return redirect(url_for('index'))
     
     try:
-        with open(content_file_path, 'r', encoding='utf-8') as f:
-            generated_content = f.read()
+        generated_content = read_generated_content(content_file_path)
         
         return render_template('result.html', content=generated_content)
     except Exception as e:
@@ -306,19 +676,18 @@ def download_docx():
         return redirect(url_for('index'))
     
     try:
-        with open(content_file_path, 'r', encoding='utf-8') as f:
-            generated_content = f.read()
+        generated_content = read_generated_content(content_file_path)
         
-        # Convert the content to a DOCX file
-        docx_bytes = create_docx_from_text(generated_content)
+        # Convert the content to a DOCX file (reused if this content was converted before)
+        docx_bytes = build_docx_bytes(generated_content)
         
-        if not docx_bytes:
+        if docx_bytes is None:
             app.logger.error("Failed to create DOCX file")
             return jsonify({'error': 'Failed to create DOCX file'}), 500
         
-        # Return the DOCX file as a download
+        # Return the DOCX file as a download, from a fresh stream per request
         return send_file(
-            docx_bytes,
+            io.BytesIO(docx_bytes),
             mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document',
             as_attachment=True,
             download_name='generated_content.docx'
@@ -333,6 +702,46 @@ def stats():
     stats = get_storage_stats(config.UPLOAD_FOLDER)
     return jsonify(stats)
 
+def flush_leads():
+    """Append all buffered leads to logs/leads.jsonl in a single write"""
+    with _lead_write_lock:
+        with _lead_lock:
+            batch = _lead_buffer[:]
+            _lead_buffer.clear()
+        if not batch:
+            return
+        try:
+            # The log folder is created at startup. Every worker appends to the same file,
+            # so write the whole batch with one O_APPEND write rather than a buffered
+            # file, which can split a large batch into several writes that interleave.
+            leads_path = os.path.join(config.LOG_FOLDER, 'leads.jsonl')
+            data = ''.join(json.dumps(lead_record) + '\n' for lead_record in batch).encode('utf-8')
+            fd = os.open(leads_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                written = os.write(fd, data)
+                while written < len(data):
+                    written += os.write(fd, data[written:])
+            finally:
+                os.close(fd)
+        except Exception as e:
+            app.logger.error(f"Error writing {len(batch)} leads: {e}")
+
+def _lead_flusher():
+    while not _lead_stop.is_set():
+        _lead_wakeup.wait(config.LEAD_FLUSH_SECONDS)
+        _lead_wakeup.clear()
+        flush_leads()
+
+def _stop_lead_flusher():
+    _lead_stop.set()
+    _lead_wakeup.set()
+    lead_flusher.join(timeout=5)
+    flush_leads()
+
+lead_flusher = threading.Thread(target=_lead_flusher, name='lead-flusher', daemon=True)
+lead_flusher.start()
+atexit.register(_stop_lead_flusher)
+
 @app.route('/lead', methods=['POST'])
 def lead():
     """Capture lead info and mark session as captured"""
@@ -356,17 +765,14 @@ def lead():
             'utms': session.get('utms', {}),
         }
 
-        # Persist to logs/leads.jsonl
-        if not os.path.exists(config.LOG_FOLDER):
-            os.makedirs(config.LOG_FOLDER)
-        leads_path = os.path.join(config.LOG_FOLDER, 'leads.jsonl')
-        with open(leads_path, 'a', encoding='utf-8') as f:
-            import json
-            f.write(json.dumps(lead_record) + '\n')
+        with _lead_lock:
+            _lead_buffer.append(lead_record)
+            if len(_lead_buffer) >= config.LEAD_FLUSH_BATCH:
+                _lead_wakeup.set()
 
-        session['lead_captured'] = True
+        set_session_value('lead_captured', True)
         app.logger.info(f"Lead captured: {lead_record}")
-        return jsonify({'success': True})
+        return jsonify({'success': True}), 202
     except Exception as e:
         app.logger.error(f"Error capturing lead: {e}")
         return jsonify({'error': 'Failed to capture lead'}), 500
@@ -380,9 +786,43 @@ def lead_status():
         'lead_captured': bool(session.get('lead_captured', False))
     })
 
+def _send_email_job(to_email, name, generated_content):
+    """Email generated content to a user (runs on the email executor)"""
+    try:
+        msg = EmailMessage()
+        msg['Subject'] = 'Your generated content from innate c3 Writing Assistant'
+        msg['From'] = config.EMAIL_SENDER
+        msg['To'] = to_email
+        greeting = f"Hi {name}," if name else "Hi,"
+        body = f"""{greeting}
+
+Attached is the content you generated with the innate c3 Writing Assistant.
+
+—
+innate c3
+https://innatec3.com
+"""
+        msg.set_content(body)
+
+        # Attach the content as a file, reusing the DOCX built for downloads;
+        # fall back to plain text if DOCX conversion is unavailable
+        docx_bytes = build_docx_bytes(generated_content)
+        if docx_bytes is not None:
+            msg.add_attachment(docx_bytes, maintype='application',
+                               subtype='vnd.openxmlformats-officedocument.wordprocessingml.document',
+                               filename='generated_content.docx')
+        else:
+            msg.add_attachment(generated_content.encode('utf-8'), maintype='text', subtype='plain',
+                               filename='generated_content.txt')
+
+        smtp_pool.send(msg, config.SMTP_HOST, config.SMTP_PORT, config.SMTP_USER, config.SMTP_PASSWORD)
+        app.logger.info(f"Emailed result to {to_email}")
+    except Exception as e:
+        app.logger.error(f"Error sending email: {e}")
+
 @app.route('/email-result', methods=['POST'])
 def email_result():
-    """Email the generated content to the provided address"""
+    """Queue the generated content to be emailed to the provided address"""
     content_file_path = session.get('content_file_path', '')
     if not content_file_path or not os.path.exists(content_file_path):
         return jsonify({'error': 'No content to email'}), 400
@@ -393,54 +833,25 @@ def email_result():
         return jsonify({'error': 'Email is required'}), 400
 
     try:
-        with open(content_file_path, 'r', encoding='utf-8') as f:
-            generated_content = f.read()
+        generated_content = read_generated_content(content_file_path)
 
         if not config.SMTP_HOST or not config.SMTP_USER or not config.SMTP_PASSWORD or not config.EMAIL_SENDER:
             app.logger.info(f"[DEV] Would send email to {to_email} with sender {config.EMAIL_SENDER}. SMTP not configured.")
             return jsonify({'success': True, 'dev': True})
 
-        msg = EmailMessage()
-        msg['Subject'] = 'Your generated content from innate c3 Writing Assistant'
-        msg['From'] = config.EMAIL_SENDER
-        msg['To'] = to_email
-        greeting = f"Hi {name}," if name else "Hi,"
-        body = f"""{greeting}
-
-Attached below is the content you generated with the innate c3 Writing Assistant.
-
-—
-innate c3
-https://innatec3.com
-"""
-        msg.set_content(body + "\n\n" + generated_content)
-
-        with smtplib.SMTP(config.SMTP_HOST, config.SMTP_PORT) as server:
-            server.starttls()
-            server.login(config.SMTP_USER, config.SMTP_PASSWORD)
-            server.send_message(msg)
-
-        app.logger.info(f"Emailed result to {to_email}")
-        return jsonify({'success': True})
+        email_executor.submit(_send_email_job, to_email, name, generated_content)
+        return jsonify({'success': True}), 202
     except Exception as e:
-        app.logger.error(f"Error sending email: {e}")
+        app.logger.error(f"Error queueing email: {e}")
         return jsonify({'error': 'Failed to send email'}), 500
 
-# Create required directories at startup
-def create_directories():
-    """Create all required directories at startup"""
-    # Ensure upload directory exists
-    if not os.path.exists(config.UPLOAD_FOLDER):
-        os.makedirs(config.UPLOAD_FOLDER)
-        app.logger.info(f"Created upload directory: {config.UPLOAD_FOLDER}")
-    
-    # Ensure log directory exists
-    if not os.path.exists(config.LOG_FOLDER):
-        os.makedirs(config.LOG_FOLDER)
-        app.logger.info(f"Created log directory: {config.LOG_FOLDER}")
-
-# Call create_directories during initialization
-create_directories()
+# Clean up old uploads in the background rather than on page load. Under the
+# debug reloader only the child process (WERKZEUG_RUN_MAIN) starts the thread.
+if not app.debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+    cleanup_stop = start_cleanup_thread(config.UPLOAD_FOLDER, config.FILE_RETENTION_DAYS,
+                                        config.CLEANUP_INTERVAL_SECONDS)
+    # Stop the loop at exit so a shutdown never starts a new pass mid-teardown
+    atexit.register(cleanup_stop.set)
 
 if __name__ == '__main__':
     # Run the app
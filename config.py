@@ -11,10 +11,31 @@ class Config:
     
     # File upload settings
     UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
-    ALLOWED_EXTENSIONS = {'txt', 'pdf', 'doc', 'docx'}
+    ALLOWED_EXTENSIONS = frozenset({'txt', 'pdf', 'doc', 'docx'})
     MAX_CONTENT_LENGTH = 10 * 1024 * 1024  # 10MB
     MAX_FILES_PER_CATEGORY = 3
+    TEXT_CACHE_FOLDER = os.path.join(UPLOAD_FOLDER, '.text_cache')  # extracted text keyed by file SHA-256 and extension
     FILE_RETENTION_DAYS = 7
+    CLEANUP_INTERVAL_SECONDS = 60 * 60  # run upload cleanup hourly in the background
+    
+    # Server-side sessions (Flask-Session): the cookie only carries the session id.
+    # Sessions are stored on disk unless SESSION_REDIS_URL is set (requires the redis package).
+    SESSION_REDIS_URL = os.environ.get('SESSION_REDIS_URL')
+    SESSION_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'flask_session')
+    SESSION_FILE_THRESHOLD = 10000  # max stored sessions before the oldest are pruned
+    SESSION_REFRESH_EACH_REQUEST = False  # only write the session store when the session changes
+    SESSION_COOKIE_SAMESITE = 'Lax'
+    
+    # Cache of previous generations, keyed by model and prompt
+    GENERATION_CACHE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'generation_cache')
+    GENERATION_CACHE_TTL = 24 * 60 * 60  # seconds
+    GENERATION_CACHE_THRESHOLD = 1000  # max cached generations on disk
+    
+    # Response compression (Flask-Compress). Server-sent events and DOCX downloads
+    # (already zip-compressed) are not listed, so they pass through untouched.
+    COMPRESS_MIMETYPES = ['text/html', 'application/json', 'text/plain']
+    COMPRESS_LEVEL = 6
+    COMPRESS_STREAMS = False
     
     # Logging settings
     LOG_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs')
@@ -25,6 +46,8 @@ class Config:
     # Lead gating and email settings
     ENABLE_GATING = True  # toggle soft-gating of premium actions
     FREE_DOWNLOAD_DOCX = False  # if False, gate DOCX download behind lead form
+    LEAD_FLUSH_SECONDS = 2  # how often buffered leads are appended to leads.jsonl
+    LEAD_FLUSH_BATCH = 50  # flush early once this many leads are buffered
 
     # Outbound email (optional; if unset, app will log instead of sending)
     EMAIL_SENDER = os.environ.get('EMAIL_SENDER')  # e.g., "innate c3 <no-reply@innatec3.com>"
@@ -32,10 +55,17 @@ class Config:
     SMTP_PORT = int(os.environ.get('SMTP_PORT', '587'))
     SMTP_USER = os.environ.get('SMTP_USER')
     SMTP_PASSWORD = os.environ.get('SMTP_PASSWORD')
+    EMAIL_WORKERS = int(os.environ.get('EMAIL_WORKERS', '4'))  # background email senders
     
     # Claude model settings
-    CLAUDE_MODEL = "claude-3-haiku-20240307"  # Updated for Messages API
-    MAX_TOKENS = 4000
+    CLAUDE_MODEL = os.environ.get('CLAUDE_MODEL', 'claude-3-5-haiku-latest')  # Messages API model with prompt caching
+    MAX_TOKENS = int(os.environ.get('CLAUDE_MAX_TOKENS', '4000'))
+    
+    # Anthropic HTTP connection pool (shared by all requests in a worker)
+    ANTHROPIC_MAX_CONNECTIONS = 40
+    ANTHROPIC_MAX_KEEPALIVE = 20
+    ANTHROPIC_KEEPALIVE_EXPIRY = 120.0  # seconds an idle connection is kept open
+    ANTHROPIC_TIMEOUT = 120.0  # seconds; long generations stream for a while
 
 class DevelopmentConfig(Config):
     """Development configuration"""
@@ -48,6 +78,7 @@ class TestingConfig(Config):
     TESTING = True
     # Use a separate test upload folder
     UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_uploads')
+    TEXT_CACHE_FOLDER = os.path.join(UPLOAD_FOLDER, '.text_cache')
 
 class ProductionConfig(Config):
     """Production configuration"""
@@ -4,7 +4,6 @@ Run script for the Writing Assistant application.
 This script provides a convenient way to start the application.
 """
 
-import os
 import argparse
 from app import app
 
@@ -20,10 +19,6 @@ def main():
     """Main entry point for the application."""
     args = parse_args()
     
-    # Ensure required directories exist
-    os.makedirs('uploads', exist_ok=True)
-    os.makedirs('logs', exist_ok=True)
-    
     # Print startup message
     print(f"Starting Writing Assistant on http://{args.host}:{args.port}")
     print("Press Ctrl+C to stop the server")
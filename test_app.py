@@ -8,7 +8,28 @@ import os
 import unittest
 import tempfile
 import shutil
+import json
+from unittest import mock
+import docx
+from docx.oxml import parse_xml
+from cachelib import SimpleCache
+import app as app_module
 from app import app
+from utils import cleanup, prompt_builder
+from utils.file_processor import extract_text_from_docx, extract_text_from_file_disk_cached
+
+class ByteTokenizer:
+    """Stand-in for a tiktoken encoding with one token per UTF-8 byte."""
+
+    def __init__(self):
+        self.encode_calls = 0
+
+    def encode(self, text, disallowed_special=()):
+        self.encode_calls += 1
+        return list(text.encode('utf-8'))
+
+    def decode_bytes(self, token_ids):
+        return bytes(token_ids)
 
 class WritingAssistantTestCase(unittest.TestCase):
     """Test case for the Writing Assistant application."""
@@ -23,6 +44,22 @@ class WritingAssistantTestCase(unittest.TestCase):
         app.config['UPLOAD_FOLDER'] = self.test_upload_dir
         app.config['WTF_CSRF_ENABLED'] = False  # Disable CSRF protection for testing
         
+        # Routes read the folders from the config module, not app.config
+        folder_patcher = mock.patch.multiple('app.config', UPLOAD_FOLDER=self.test_upload_dir,
+                                             TEXT_CACHE_FOLDER=os.path.join(self.test_upload_dir, '.text_cache'))
+        folder_patcher.start()
+        self.addCleanup(folder_patcher.stop)
+        
+        # Keep server-side sessions in memory instead of the repo's flask_session folder
+        session_patcher = mock.patch.object(app.session_interface, 'cache', SimpleCache())
+        session_patcher.start()
+        self.addCleanup(session_patcher.stop)
+        
+        # Use an empty in-memory generation cache for each test
+        cache_patcher = mock.patch('app.generation_cache', SimpleCache())
+        cache_patcher.start()
+        self.addCleanup(cache_patcher.stop)
+        
         # Create a test client
         self.client = app.test_client()
         
@@ -50,6 +87,12 @@ class WritingAssistantTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn(b'Writing Assistant', response.data)
     
+    def test_index_page_is_compressed(self):
+        """Test that HTML responses are gzip-compressed when the client accepts it."""
+        response = self.client.get('/', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers.get('Content-Encoding'), 'gzip')
+    
     def test_file_upload(self):
         """Test file upload functionality."""
         # Set up a test session
@@ -71,6 +114,23 @@ class WritingAssistantTestCase(unittest.TestCase):
             self.assertTrue(response_data['success'])
             self.assertEqual(response_data['filename'], f'test_{category}.txt')
     
+    def test_file_upload_stream(self):
+        """Test raw-body streaming upload."""
+        with self.client.session_transaction() as session:
+            session['session_id'] = 'test_session'
+
+        response = self.client.post(
+            '/upload-stream/materials',
+            data=b'Streamed content',
+            headers={'X-Filename': 'streamed%20notes.txt'}
+        )
+
+        # Check response
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['filename'], 'streamed_notes.txt')
+        with open(os.path.join(self.test_upload_dir, 'test_session', 'materials', 'streamed_notes.txt'), 'rb') as f:
+            self.assertEqual(f.read(), b'Streamed content')
+
     def test_get_files(self):
         """Test getting list of files for a category."""
         # Set up a test session
@@ -137,5 +197,227 @@ class WritingAssistantTestCase(unittest.TestCase):
         self.assertIn('error', response_data)
         self.assertEqual(response_data['error'], 'Invalid category')
 
+    def test_generate_stream(self):
+        """Test that generated content is streamed as server-sent events."""
+        with self.client.session_transaction() as session:
+            session['session_id'] = 'test_session'
+        
+        stream = mock.MagicMock()
+        stream.__enter__.return_value.text_stream = iter(['Hello', ' world'])
+        with mock.patch('app.anthropic') as anthropic:
+            anthropic.messages.stream.return_value = stream
+            response = self.client.post('/generate-stream', data={'brief': 'Test brief'},
+                                        headers={'Accept-Encoding': 'gzip'})
+            body = response.get_data(as_text=True)
+        
+        # Check response
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.mimetype.startswith('text/event-stream'))
+        self.assertEqual(response.headers['X-Accel-Buffering'], 'no')
+        self.assertNotIn('Content-Encoding', response.headers)
+        events = [json.loads(line[len('data: '):]) for line in body.split('\n\n') if line]
+        self.assertEqual(events, [{'delta': 'Hello'}, {'delta': ' world'}, {'done': True}])
+    
+    def test_generate_reuses_cached_content(self):
+        """Test that an identical generation request is served from the cache."""
+        with self.client.session_transaction() as session:
+            session['session_id'] = 'test_session'
+        
+        with mock.patch('app.anthropic') as anthropic:
+            anthropic.messages.create.return_value.content = [mock.Mock(text='Cached draft')]
+            first = self.client.post('/generate', data={'brief': 'Cache me'})
+            second = self.client.post('/generate', data={'brief': 'Cache me'})
+        
+        # Check that only the first request called the API
+        self.assertEqual(anthropic.messages.create.call_count, 1)
+        self.assertEqual(first.get_json()['content'], 'Cached draft')
+        self.assertEqual(second.get_json()['content'], 'Cached draft')
+    
+    def test_generate_after_session_folder_removed(self):
+        """Test that generation recreates a session folder that cleanup removed in the meantime."""
+        with self.client.session_transaction() as session:
+            session['session_id'] = 'test_session'
+        
+        with mock.patch('app.anthropic') as anthropic:
+            anthropic.messages.create.return_value.content = [mock.Mock(text='Draft')]
+            first = self.client.post('/generate', data={'brief': 'First brief'})
+            shutil.rmtree(os.path.join(self.test_upload_dir, 'test_session'))
+            second = self.client.post('/generate', data={'brief': 'Second brief'})
+        
+        # Check that both generations were saved
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 200)
+        self.assertTrue(os.path.exists(os.path.join(self.test_upload_dir, 'test_session', 'generated_content.txt')))
+
+    def test_generate_requires_brief(self):
+        """Test that generation is rejected without a brief."""
+        for endpoint in ['/generate', '/generate-stream']:
+            response = self.client.post(endpoint, data={})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.get_json()['error'], 'Brief is required')
+
+    def test_download_docx(self):
+        """Test downloading the generated content as a DOCX file."""
+        content_file = os.path.join(self.test_upload_dir, 'generated_content.txt')
+        with open(content_file, 'w', encoding='utf-8') as f:
+            f.write('First paragraph\n\nSecond paragraph')
+        
+        with self.client.session_transaction() as session:
+            session['content_file_path'] = content_file
+        
+        response = self.client.get('/download-docx')
+        
+        # Check response
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data.startswith(b'PK'))
+        self.assertEqual(response.content_length, len(response.data))
+
+    def test_docx_text_skips_text_box_content(self):
+        """Test that text box runs are not repeated in the paragraph text, matching python-docx."""
+        document = docx.Document()
+        paragraph = document.add_paragraph('Before')
+        text_box = '<w:txbxContent><w:p><w:r><w:t>BOXTEXT</w:t></w:r></w:p></w:txbxContent>'
+        paragraph._p.append(parse_xml(
+            '<w:r xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main" '
+            'xmlns:mc="http://schemas.openxmlformats.org/markup-compatibility/2006"><mc:AlternateContent>'
+            f'<mc:Choice Requires="wps">{text_box}</mc:Choice><mc:Fallback>{text_box}</mc:Fallback>'
+            '</mc:AlternateContent></w:r>'
+        ))
+        docx_path = os.path.join(self.test_upload_dir, 'text_box.docx')
+        document.save(docx_path)
+        
+        self.assertEqual(extract_text_from_docx(docx_path), 'Before')
+
+    def test_docx_text_expands_merged_cells(self):
+        """Test that merged table cells are repeated across the grid the way python-docx's row.cells are."""
+        document = docx.Document()
+        table = document.add_table(rows=3, cols=3)
+        for row in range(3):
+            for column in range(3):
+                table.cell(row, column).text = f'{row}{column}'
+        table.cell(0, 0).merge(table.cell(0, 1))
+        table.cell(1, 2).merge(table.cell(2, 2))
+        docx_path = os.path.join(self.test_upload_dir, 'merged.docx')
+        document.save(docx_path)
+        
+        self.assertEqual(extract_text_from_docx(docx_path),
+                         '00\n01 | 00\n01 | 02\n\n10 | 11 | 12\n22\n\n20 | 21 | 12\n22')
+
+    def test_text_cache_is_keyed_by_extension(self):
+        """Test that identical bytes under another extension don't reuse a cached extraction or placeholder."""
+        text_cache_folder = os.path.join(self.test_upload_dir, '.text_cache')
+        for filename in ['notes.txt', 'notes.doc', 'other.doc']:
+            with open(os.path.join(self.test_upload_dir, filename), 'wb') as f:
+                f.write(b'Same bytes')
+        
+        results = [extract_text_from_file_disk_cached(os.path.join(self.test_upload_dir, filename), text_cache_folder)
+                   for filename in ['notes.txt', 'notes.doc', 'other.doc']]
+        
+        self.assertEqual(results[0], 'Same bytes')
+        self.assertIn('notes.doc', results[1])
+        self.assertIn('other.doc', results[2])
+        self.assertEqual(len(os.listdir(text_cache_folder)), 1)
+
+    def test_dedupe_paragraphs_across_files(self):
+        """Test that a paragraph repeated across files is kept once, with file headers and short paragraphs intact."""
+        text = ('--- From a.txt ---\nThis paragraph is long enough to be deduplicated across files.\n\nShort one\n\n'
+                '--- From b.txt ---\nThis paragraph is long enough to be deduplicated  across\nfiles.\n\nShort one')
+        
+        self.assertEqual(prompt_builder.dedupe_paragraphs(text),
+                         '--- From a.txt ---\nThis paragraph is long enough to be deduplicated across files.\n\n'
+                         'Short one\n\n--- From b.txt ---\n\nShort one')
+
+    def test_estimate_token_count_uses_tokenizer(self):
+        """Test that token counts come from the tokenizer when it is available, cached by content."""
+        tokenizer = ByteTokenizer()
+        with mock.patch('utils.prompt_builder.get_tokenizer', return_value=tokenizer):
+            counts = [prompt_builder.estimate_token_count('Token \u00e9stimate test') for _ in range(2)]
+        
+        self.assertEqual(counts, [len('Token \u00e9stimate test'.encode('utf-8'))] * 2)
+        self.assertLessEqual(tokenizer.encode_calls, 1)
+
+    def test_truncate_on_token_ids(self):
+        """Test that truncation cuts on token ids, encodes once and drops a split trailing character."""
+        tokenizer = ByteTokenizer()
+        with mock.patch('utils.prompt_builder.get_tokenizer', return_value=tokenizer):
+            truncated = prompt_builder.truncate_text_to_fit('h\u00e9llo w\u00f6rld', 2, 'source material')
+        
+        self.assertTrue(truncated.startswith('h\n\n[Note: The source material content was truncated from 13 to 2 tokens'))
+        self.assertEqual(tokenizer.encode_calls, 1)
+
+    def test_truncate_without_tokenizer(self):
+        """Test that the length-based fallback keeps the longest prefix whose estimate fits the budget."""
+        text = 'abcdefghij' * 10
+        with mock.patch('utils.prompt_builder.get_tokenizer', return_value=None):
+            for max_tokens in [0, 5, 24]:
+                truncated = prompt_builder.truncate_text_to_fit(text, max_tokens, 'past examples')
+                kept = truncated.split('\n\n[Note:')[0]
+                self.assertTrue(text.startswith(kept))
+                self.assertLessEqual(prompt_builder.estimate_token_count(kept), max_tokens)
+                self.assertGreater(prompt_builder.estimate_token_count(text[:len(kept) + 1]), max_tokens)
+
+    def test_single_cleanup_owner(self):
+        """Test that only one holder of the cleanup lock runs scheduled cleanup at a time."""
+        owner = cleanup._claim_cleanup(self.test_upload_dir)
+        self.assertIsNotNone(owner)
+        if owner is True:
+            self.skipTest('file locking is not available')
+        
+        self.assertIsNone(cleanup._claim_cleanup(self.test_upload_dir))
+        owner.close()
+        next_owner = cleanup._claim_cleanup(self.test_upload_dir)
+        self.assertIsNotNone(next_owner)
+        next_owner.close()
+
+    def assertStatsMatchRescan(self):
+        """Assert that the stored storage stats agree with a fresh walk of the upload folder."""
+        cleanup.get_storage_stats.cache_clear()
+        stats = cleanup.get_storage_stats(self.test_upload_dir)
+        sessions = cleanup._scan_sessions(self.test_upload_dir)
+        self.assertEqual(stats['total_size'], sum(s['size'] for s in sessions.values()))
+        self.assertEqual(stats['total_files'], sum(s['files'] for s in sessions.values()))
+        self.assertEqual(stats['total_sessions'], len(sessions))
+    
+    def test_storage_stats_track_changes(self):
+        """Test that journaled storage changes add up to what is on disk."""
+        cleanup.rebuild_storage_stats(self.test_upload_dir)
+        with self.client.session_transaction() as session:
+            session['session_id'] = 'test_session'
+        
+        # An upload, a visitor who only lists files, and a generation
+        self.client.post('/upload-stream/materials', data=b'x' * 1000, headers={'X-Filename': 'notes.txt'})
+        app.test_client().get('/files/materials')
+        with mock.patch('app.anthropic') as anthropic:
+            anthropic.messages.create.return_value.content = [mock.Mock(text='y' * 5000)]
+            self.client.post('/generate', data={'brief': 'Stats brief'})
+        self.assertStatsMatchRescan()
+        
+        self.client.delete('/delete/materials/notes.txt')
+        self.assertStatsMatchRescan()
+    
+    def test_cleanup_rebuilds_storage_stats(self):
+        """Test that a cleanup pass corrects changes that were never recorded."""
+        cleanup.rebuild_storage_stats(self.test_upload_dir)
+        with open(os.path.join(self.test_upload_dir, 'test_session', 'style', 'unrecorded.txt'), 'w') as f:
+            f.write('Not journaled')
+        
+        cleanup.cleanup_old_files(self.test_upload_dir)
+        self.assertStatsMatchRescan()
+
+    def test_lead_is_written_in_background(self):
+        """Test that lead capture buffers the record and returns immediately."""
+        with mock.patch('app.config.LOG_FOLDER', self.test_upload_dir):
+            response = self.client.post('/lead', data={'email': 'test@example.com', 'action': 'docx_download'})
+            app_module.flush_leads()
+
+        # Check response
+        self.assertEqual(response.status_code, 202)
+        self.assertTrue(response.get_json()['success'])
+        with open(os.path.join(self.test_upload_dir, 'leads.jsonl'), encoding='utf-8') as f:
+            lead_record = json.loads(f.readline())
+        self.assertEqual(lead_record['email'], 'test@example.com')
+        with self.client.session_transaction() as session:
+            self.assertTrue(session['lead_captured'])
+
 if __name__ == '__main__':
     unittest.main()
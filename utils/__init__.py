@@ -7,39 +7,85 @@ and cleanup operations.
 
 from .file_processor import (
     extract_text_from_file,
+    extract_text_from_file_cached,
+    extract_text_from_file_disk_cached,
     extract_text_from_folder,
+    file_sha256,
     get_file_size,
     get_folder_size
 )
 
 from .prompt_builder import (
     construct_prompt,
+    construct_prompt_parts,
     optimize_prompt_for_token_limits,
+    optimize_prompt_parts_for_token_limits,
+    fit_examples_to_token_limits,
     get_format_details,
+    estimate_token_count,
+    text_digest,
+    dedupe_paragraphs,
     FORMAT_DETAILS
 )
 
+from .json_provider import ORJSONProvider
+
+from .smtp_pool import SMTPConnectionPool
+
+from .ttl_cache import ttl_cache
+
+from .native_threads import native_thread_pool
+
 from .cleanup import (
     cleanup_old_files,
+    empty_trash,
+    start_cleanup_thread,
     get_storage_stats,
+    rebuild_storage_stats,
+    record_storage_change,
     format_size
 )
 
 __all__ = [
     # File processor
     'extract_text_from_file',
+    'extract_text_from_file_cached',
+    'extract_text_from_file_disk_cached',
     'extract_text_from_folder',
+    'file_sha256',
     'get_file_size',
     'get_folder_size',
     
     # Prompt builder
     'construct_prompt',
+    'construct_prompt_parts',
     'optimize_prompt_for_token_limits',
+    'optimize_prompt_parts_for_token_limits',
+    'fit_examples_to_token_limits',
     'get_format_details',
+    'estimate_token_count',
+    'text_digest',
+    'dedupe_paragraphs',
     'FORMAT_DETAILS',
     
+    # JSON provider
+    'ORJSONProvider',
+    
+    # SMTP pool
+    'SMTPConnectionPool',
+    
+    # TTL cache
+    'ttl_cache',
+    
+    # Native threads
+    'native_thread_pool',
+    
     # Cleanup
     'cleanup_old_files',
+    'empty_trash',
+    'start_cleanup_thread',
     'get_storage_stats',
+    'rebuild_storage_stats',
+    'record_storage_change',
     'format_size'
 ]
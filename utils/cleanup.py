@@ -1,67 +1,475 @@
 import os
+import json
+import time
+import uuid
 import shutil
 import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from .ttl_cache import ttl_cache
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
-def cleanup_old_files(upload_folder, retention_days=7):
+# File locking keeps stats updates from several worker processes from clobbering each other
+try:
+    import fcntl
+    FCNTL_SUPPORT = True
+except ImportError:
+    FCNTL_SUPPORT = False
+
+# Upper bound on threads used to delete expired sessions
+CLEANUP_MAX_WORKERS = 8
+
+# Per-session storage totals, so get_storage_stats does not have to walk the tree.
+# Each cleanup pass rescans them into the stats file; in between, uploads, deletes
+# and content writes append their changes to the journal, which is replayed on read.
+STATS_FILE_NAME = '.stats.json'
+STATS_JOURNAL_NAME = '.stats.journal'
+STATS_LOCK_FILE_NAME = '.stats.lock'
+_stats_lock = threading.Lock()
+
+# Held (flock) by the one process that runs scheduled cleanup, so gunicorn workers
+# don't all sweep the same session folders at once
+CLEANUP_LOCK_FILE_NAME = '.cleanup.lock'
+
+# Expired sessions are renamed into this folder (inside the upload folder) and
+# deleted afterwards, so they disappear atomically and cleanup never waits on unlinks
+TRASH_FOLDER_NAME = '.trash'
+_trash_lock = threading.Lock()
+
+class _LazyTimestamp:
+    """Format a POSIX timestamp only if the log record is actually emitted"""
+    __slots__ = ('timestamp',)
+
+    def __init__(self, timestamp):
+        self.timestamp = timestamp
+
+    def __str__(self):
+        return datetime.fromtimestamp(self.timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+def cleanup_old_files(upload_folder, retention_days=7, count_files=False, parallel=True):
     """
     Remove files and folders older than the specified retention period
     
     Args:
         upload_folder (str): Path to the upload folder
         retention_days (int): Number of days to retain files
+        count_files (bool): Walk each expired session before removing it to count its
+            files. Off by default, since it doubles the directory reads.
+        parallel (bool): Empty the trash on a thread pool. Turn off on slow or
+            network disks, where concurrent deletes do not help.
         
     Returns:
-        tuple: (int, int) - Number of files removed, number of directories removed
+        tuple: (int, int) - Number of files removed (session files are only counted
+        with count_files), number of directories removed
     """
     if not os.path.exists(upload_folder):
-        logger.warning(f"Upload folder does not exist: {upload_folder}")
+        logger.warning("Upload folder does not exist: %s", upload_folder)
         return 0, 0
     
     cutoff_date = datetime.now() - timedelta(days=retention_days)
-    logger.info(f"Cleaning up files older than {cutoff_date.strftime('%Y-%m-%d %H:%M:%S')}")
+    cutoff = cutoff_date.timestamp()
+    logger.info("Cleaning up files older than %s", _LazyTimestamp(cutoff))
     
     files_removed = 0
     dirs_removed = 0
+    stale_sessions = []
     
-    # Iterate through session directories
-    for session_id in os.listdir(upload_folder):
-        session_path = os.path.join(upload_folder, session_id)
+    # Iterate through session directories; scandir entries carry their file type and stat
+    with os.scandir(upload_folder) as entries:
+        session_entries = list(entries)
+    
+    for entry in session_entries:
+        session_id = entry.name
+        session_path = entry.path
         
         # Skip if not a directory
-        if not os.path.isdir(session_path):
+        if not entry.is_dir(follow_symlinks=False):
+            continue
+        
+        # Hidden folders are the trash or shared caches (e.g. extracted text); expire cache files individually
+        if session_id == TRASH_FOLDER_NAME:
+            continue
+        if session_id.startswith('.'):
+            files_removed += _remove_old_files(session_path, cutoff_date)
             continue
         
         # Check the modification time of the session directory
         try:
-            mod_time = datetime.fromtimestamp(os.path.getmtime(session_path))
+            mod_time = entry.stat(follow_symlinks=False).st_mtime
             
-            if mod_time < cutoff_date:
-                logger.info(f"Removing old session directory: {session_id} (last modified: {mod_time.strftime('%Y-%m-%d %H:%M:%S')})")
-                
-                # Count files before removal
-                file_count = sum(len(files) for _, _, files in os.walk(session_path))
-                
-                # Remove the directory and all its contents
-                shutil.rmtree(session_path)
-                
-                files_removed += file_count
-                dirs_removed += 1
-                
-                logger.info(f"Removed session directory {session_id} with {file_count} files")
+            if mod_time < cutoff:
+                logger.info("Removing old session directory: %s (last modified: %s)",
+                            session_id, _LazyTimestamp(mod_time))
+                stale_sessions.append((session_id, session_path))
         except Exception as e:
-            logger.error(f"Error processing session directory {session_id}: {str(e)}")
+            logger.error("Error processing session directory %s: %s", session_id, e)
+    
+    # Move expired sessions into the trash (a cheap rename each), then delete
+    # their contents on a background thread
+    trash_folder = os.path.join(upload_folder, TRASH_FOLDER_NAME)
+    for session_id, session_path in stale_sessions:
+        file_count = _remove_session(session_id, session_path, trash_folder, count_files=count_files)
+        if file_count is not None:
+            dirs_removed += 1
+            files_removed += file_count
+    
+    empty_trash_in_background(upload_folder, parallel=parallel)
+    
+    # Recount the remaining sessions, which also corrects any drift in the
+    # journaled changes (e.g. from a process killed mid-request)
+    rebuild_storage_stats(upload_folder)
+    get_storage_stats.cache_clear()
     
-    logger.info(f"Cleanup complete. Removed {files_removed} files and {dirs_removed} directories.")
+    logger.info("Cleanup complete. Removed %d files and %d directories.", files_removed, dirs_removed)
     return files_removed, dirs_removed
 
+def _remove_session(session_id, session_path, trash_folder, count_files=False):
+    """
+    Remove one session directory by renaming it into the trash folder
+    
+    Falls back to deleting it in place if the rename fails.
+    
+    Returns:
+        int: Number of files removed (0 unless count_files), or None if removal failed
+    """
+    try:
+        # Count files before removal, if asked
+        file_count = sum(len(files) for _, _, files in os.walk(session_path)) if count_files else 0
+        
+        try:
+            os.makedirs(trash_folder, exist_ok=True)
+            os.rename(session_path, os.path.join(trash_folder, f"{session_id}-{uuid.uuid4().hex}"))
+        except OSError as e:
+            logger.warning("Could not move %s to trash, deleting in place: %s", session_id, e)
+            shutil.rmtree(session_path)
+    except Exception as e:
+        logger.error("Error removing session directory %s: %s", session_id, e)
+        return None
+    
+    if count_files:
+        logger.info("Removed session directory %s with %d files", session_id, file_count)
+    else:
+        logger.info("Removed session directory %s", session_id)
+    return file_count
+
+def empty_trash(upload_folder, parallel=True):
+    """
+    Permanently delete everything moved into the trash folder
+    
+    Args:
+        upload_folder (str): Path to the upload folder
+        parallel (bool): Delete trashed sessions on a thread pool. Turn off on slow or
+            network disks, where concurrent deletes do not help.
+        
+    Returns:
+        int: Number of trashed directories deleted
+    """
+    trash_folder = os.path.join(upload_folder, TRASH_FOLDER_NAME)
+    with _trash_lock:
+        try:
+            with os.scandir(trash_folder) as entries:
+                trashed = [entry.path for entry in entries]
+        except FileNotFoundError:
+            return 0
+        
+        # Trashed sessions are disjoint subtrees, so they can be deleted concurrently
+        def delete(path):
+            try:
+                shutil.rmtree(path)
+                return True
+            except OSError as e:
+                logger.error("Error emptying trash entry %s: %s", path, e)
+                return False
+        
+        if parallel and len(trashed) > 1:
+            workers = min(CLEANUP_MAX_WORKERS, (os.cpu_count() or 1) * 2, len(trashed))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='cleanup') as executor:
+                deleted = sum(executor.map(delete, trashed))
+        else:
+            deleted = sum(delete(path) for path in trashed)
+    
+    if deleted:
+        logger.info("Emptied %d directories from trash", deleted)
+    return deleted
+
+def empty_trash_in_background(upload_folder, parallel=True):
+    """
+    Empty the trash folder on a daemon thread, if it holds anything
+    
+    Returns:
+        threading.Thread: The started thread, or None if the trash is empty
+    """
+    trash_folder = os.path.join(upload_folder, TRASH_FOLDER_NAME)
+    try:
+        with os.scandir(trash_folder) as entries:
+            if next(entries, None) is None:
+                return None
+    except FileNotFoundError:
+        return None
+    
+    thread = threading.Thread(target=empty_trash, args=(upload_folder, parallel),
+                              name='upload-trash', daemon=True)
+    thread.start()
+    return thread
+
+def _remove_old_files(folder, cutoff_date):
+    """Remove files directly inside a folder last modified before cutoff_date; returns how many were removed"""
+    removed = 0
+    cutoff = cutoff_date.timestamp()
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            try:
+                if entry.is_file(follow_symlinks=False) and entry.stat(follow_symlinks=False).st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError as e:
+                logger.error("Error removing cached file %s: %s", entry.path, e)
+    if removed:
+        logger.info("Removed %d expired files from %s", removed, os.path.basename(folder))
+    return removed
+
+def _claim_cleanup(upload_folder):
+    """
+    Try to become the process that runs scheduled cleanup
+    
+    Returns:
+        The open lock file, to keep for as long as this process owns cleanup; True
+        where file locking is unavailable (a single process is assumed); or None if
+        another process owns cleanup
+    """
+    if not FCNTL_SUPPORT:
+        return True
+    
+    lock_file = open(os.path.join(upload_folder, CLEANUP_LOCK_FILE_NAME), 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+def start_cleanup_thread(upload_folder, retention_days=7, interval_seconds=3600):
+    """
+    Run cleanup_old_files in a background daemon thread, immediately and then periodically
+    
+    Every process may start the thread, but only the one holding the cleanup lock
+    file runs passes. The others retry each interval, so cleanup moves to another
+    process if the owner exits.
+    
+    Args:
+        upload_folder (str): Path to the upload folder
+        retention_days (int): Number of days to retain files
+        interval_seconds (int): Seconds to wait between cleanup runs
+        
+    Returns:
+        threading.Event: Set this event to stop the cleanup thread
+    """
+    stop_event = threading.Event()
+    
+    def run():
+        owner = None
+        while True:
+            try:
+                if owner is None:
+                    owner = _claim_cleanup(upload_folder)
+                    if owner is not None:
+                        logger.info("Process %d owns upload cleanup", os.getpid())
+                if owner is not None:
+                    cleanup_old_files(upload_folder, retention_days)
+            except Exception as e:
+                logger.error("Error during scheduled cleanup: %s", e)
+            
+            if stop_event.wait(interval_seconds):
+                break
+        
+        if owner is not None and owner is not True:
+            owner.close()
+    
+    thread = threading.Thread(target=run, name='upload-cleanup', daemon=True)
+    thread.start()
+    logger.info("Started cleanup thread (every %d seconds)", interval_seconds)
+    
+    return stop_event
+
+def _walk_size(path):
+    """
+    Total the size and number of files under a directory
+    
+    Uses scandir entries, whose stat results come from the directory read on
+    most platforms, instead of a separate getsize() per file. Symlinks are
+    counted as links and not followed.
+    
+    Returns:
+        tuple: (int, int) - Total size in bytes, number of files
+    """
+    total_size = 0
+    total_files = 0
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                size, files = _walk_size(entry.path)
+                total_size += size
+                total_files += files
+            else:
+                total_size += entry.stat(follow_symlinks=False).st_size
+                total_files += 1
+    return total_size, total_files
+
+@contextmanager
+def _stats_file_lock(upload_folder):
+    """Serialize stats file updates across threads and, where supported, processes"""
+    with _stats_lock:
+        if not FCNTL_SUPPORT:
+            yield
+            return
+        with open(os.path.join(upload_folder, STATS_LOCK_FILE_NAME), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _load_stats_file(upload_folder):
+    """Load per-session totals from the stats file, or None if it is missing or unreadable"""
+    try:
+        with open(os.path.join(upload_folder, STATS_FILE_NAME), 'r', encoding='utf-8') as f:
+            return json.load(f)['sessions']
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning("Ignoring unreadable storage stats file: %s", e)
+        return None
+
+def _write_stats_file(upload_folder, sessions):
+    """Atomically replace the stats file"""
+    fd, tmp_path = tempfile.mkstemp(dir=upload_folder, prefix='.stats-')
+    try:
+        with open(fd, 'w', encoding='utf-8') as f:
+            json.dump({'sessions': sessions}, f)
+        os.replace(tmp_path, os.path.join(upload_folder, STATS_FILE_NAME))
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def _scan_sessions(upload_folder):
+    """Walk every session directory and total its size and file count"""
+    sessions = {}
+    
+    # Iterate through session directories
+    with os.scandir(upload_folder) as entries:
+        for entry in entries:
+            session_id = entry.name
+            
+            # Skip if not a session directory
+            if session_id.startswith('.') or not entry.is_dir(follow_symlinks=False):
+                continue
+            
+            try:
+                # Count files and size
+                session_size, session_files = _walk_size(entry.path)
+                sessions[session_id] = {
+                    'modified': entry.stat(follow_symlinks=False).st_mtime,
+                    'size': session_size,
+                    'files': session_files
+                }
+            except Exception as e:
+                logger.error("Error processing session directory %s: %s", session_id, e)
+    
+    return sessions
+
+def rebuild_storage_stats(upload_folder):
+    """
+    Recompute per-session totals from disk and save them to the stats file
+    
+    Args:
+        upload_folder (str): Path to the upload folder
+        
+    Returns:
+        dict: Per-session totals keyed by session id
+    """
+    with _stats_file_lock(upload_folder):
+        sessions = _scan_sessions(upload_folder)
+        try:
+            _write_stats_file(upload_folder, sessions)
+            # The scan already reflects the journaled changes. A change journaled
+            # during the scan can be lost here; the next rebuild counts it.
+            os.remove(os.path.join(upload_folder, STATS_JOURNAL_NAME))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error("Could not write storage stats file: %s", e)
+    return sessions
+
+def record_storage_change(upload_folder, session_id, size_delta, files_delta):
+    """
+    Record a change in a session's stored size and file count
+    
+    Call after creating a session folder (zero deltas), saving a file (positive
+    deltas) or deleting one (negative deltas). The change is appended to the stats
+    journal as one small O_APPEND write, so requests never lock or rewrite the
+    stats file.
+    
+    Args:
+        upload_folder (str): Path to the upload folder
+        session_id (str): Session whose folder changed
+        size_delta (int): Change in bytes
+        files_delta (int): Change in number of files
+    """
+    line = json.dumps([session_id, size_delta, files_delta, time.time()]) + '\n'
+    try:
+        fd = os.open(os.path.join(upload_folder, STATS_JOURNAL_NAME), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode('utf-8'))
+        finally:
+            os.close(fd)
+    except OSError as e:
+        logger.error("Could not record storage change for session %s: %s", session_id, e)
+
+def _replay_journal(upload_folder, sessions):
+    """Apply the journaled changes to per-session totals loaded from the stats file"""
+    try:
+        with open(os.path.join(upload_folder, STATS_JOURNAL_NAME), 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return sessions
+    except OSError as e:
+        logger.warning("Could not read storage stats journal: %s", e)
+        return sessions
+    
+    for line in lines:
+        try:
+            session_id, size_delta, files_delta, modified = json.loads(line)
+        except ValueError:
+            continue  # a write still in progress
+        session_stats = sessions.setdefault(session_id, {'modified': 0, 'size': 0, 'files': 0})
+        session_stats['size'] = max(0, session_stats['size'] + size_delta)
+        session_stats['files'] = max(0, session_stats['files'] + files_delta)
+        session_stats['modified'] = max(session_stats['modified'], modified)
+    return sessions
+
+def _session_info(session_id, session_stats):
+    """Session info as returned by get_storage_stats, with the modification time as a datetime"""
+    return {
+        'id': session_id,
+        'modified': datetime.fromtimestamp(session_stats['modified']),
+        'size': session_stats['size'],
+        'files': session_stats['files']
+    }
+
+@ttl_cache(seconds=60)
 def get_storage_stats(upload_folder):
     """
     Get statistics about the storage usage
     
+    Totals come from the stats file plus the journal of changes since the last
+    cleanup pass, so the tree is only walked when the stats file is missing.
+    Results are also cached for 60 seconds.
+    
     Args:
         upload_folder (str): Path to the upload folder
         
@@ -69,7 +477,7 @@ def get_storage_stats(upload_folder):
         dict: Storage statistics
     """
     if not os.path.exists(upload_folder):
-        logger.warning(f"Upload folder does not exist: {upload_folder}")
+        logger.warning("Upload folder does not exist: %s", upload_folder)
         return {
             'total_size': 0,
             'total_files': 0,
@@ -78,63 +486,40 @@ def get_storage_stats(upload_folder):
             'newest_session': None
         }
     
+    session_totals = _load_stats_file(upload_folder)
+    if session_totals is None:
+        session_totals = rebuild_storage_stats(upload_folder)
+    else:
+        session_totals = _replay_journal(upload_folder, session_totals)
+    
     total_size = 0
     total_files = 0
-    sessions = []
+    oldest_session = None
+    newest_session = None
     
-    # Iterate through session directories
-    for session_id in os.listdir(upload_folder):
-        session_path = os.path.join(upload_folder, session_id)
-        
-        # Skip if not a directory
-        if not os.path.isdir(session_path):
-            continue
+    for session_id, session_stats in session_totals.items():
+        # Add to totals
+        total_size += session_stats['size']
+        total_files += session_stats['files']
         
-        # Get session modification time
-        try:
-            mod_time = datetime.fromtimestamp(os.path.getmtime(session_path))
-            
-            # Count files and size
-            session_size = 0
-            session_files = 0
-            
-            for root, _, files in os.walk(session_path):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    file_size = os.path.getsize(file_path)
-                    
-                    session_size += file_size
-                    session_files += 1
-            
-            # Add to totals
-            total_size += session_size
-            total_files += session_files
-            
-            # Add session info
-            sessions.append({
-                'id': session_id,
-                'modified': mod_time,
-                'size': session_size,
-                'files': session_files
-            })
-        except Exception as e:
-            logger.error(f"Error processing session directory {session_id}: {str(e)}")
-    
-    # Sort sessions by modification time
-    sessions.sort(key=lambda x: x['modified'])
-    
-    # Get oldest and newest sessions
-    oldest_session = sessions[0] if sessions else None
-    newest_session = sessions[-1] if sessions else None
+        # Track the oldest and newest sessions by modification time; ties go to
+        # the first oldest and the last newest, as a stable sort would order them
+        modified = session_stats['modified']
+        if oldest_session is None or modified < oldest_session[1]['modified']:
+            oldest_session = (session_id, session_stats)
+        if newest_session is None or modified >= newest_session[1]['modified']:
+            newest_session = (session_id, session_stats)
     
     return {
         'total_size': total_size,
         'total_files': total_files,
-        'total_sessions': len(sessions),
-        'oldest_session': oldest_session,
-        'newest_session': newest_session
+        'total_sessions': len(session_totals),
+        'oldest_session': _session_info(*oldest_session) if oldest_session else None,
+        'newest_session': _session_info(*newest_session) if newest_session else None
     }
 
+_SIZE_UNITS = ('B', 'KB', 'MB', 'GB', 'TB')
+
 def format_size(size_bytes):
     """
     Format a size in bytes to a human-readable string
@@ -151,17 +536,11 @@ def format_size(size_bytes):
     if size_bytes == 0:
         return "0 B"
     
-    # Define size units and their thresholds
-    units = ['B', 'KB', 'MB', 'GB', 'TB']
-    i = 0
-    
-    # Convert to appropriate unit
-    while size_bytes >= 1024 and i < len(units) - 1:
-        size_bytes /= 1024.0
-        i += 1
+    # Pick the unit from the number's bit length: each unit is 2**10 times the last
+    i = max(0, min((int(size_bytes).bit_length() - 1) // 10, len(_SIZE_UNITS) - 1))
     
     # Format with appropriate precision
     if i == 0:  # Bytes
-        return f"{int(size_bytes)} {units[i]}"
+        return f"{int(size_bytes)} {_SIZE_UNITS[i]}"
     else:
-        return f"{size_bytes:.2f} {units[i]}"
+        return f"{size_bytes / (1 << (10 * i)):.2f} {_SIZE_UNITS[i]}"
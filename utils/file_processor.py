@@ -1,7 +1,10 @@
 import os
+import hashlib
 import logging
-import io
+import tempfile
+from functools import lru_cache
 from werkzeug.utils import secure_filename
+from .native_threads import native_thread_pool
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -16,6 +19,10 @@ except ImportError:
 
 try:
     import docx
+    from docx.oxml.ns import qn
+    from docx.oxml.simpletypes import ST_Merge
+    _W_T = qn('w:t')
+    _W_TAB = qn('w:tab')
     DOCX_SUPPORT = True
 except ImportError:
     DOCX_SUPPORT = False
@@ -72,19 +79,23 @@ def extract_text_from_file(file_path):
 def extract_text_from_txt(file_path):
     """Extract text from a plain text file"""
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return f.read()
-    except UnicodeDecodeError:
-        # Try with a different encoding if UTF-8 fails
-        try:
-            with open(file_path, 'r', encoding='latin-1') as f:
-                return f.read()
-        except Exception as e:
-            logger.error(f"Error reading text file with latin-1 encoding: {str(e)}")
-            return f"[Error reading text file: {str(e)}]"
+        # Read the raw bytes and decode once rather than through a text-mode stream
+        with open(file_path, 'rb') as f:
+            data = f.read()
     except Exception as e:
         logger.error(f"Error reading text file: {str(e)}")
         return f"[Error reading text file: {str(e)}]"
+    
+    try:
+        text = data.decode('utf-8')
+    except UnicodeDecodeError:
+        # Fall back to latin-1 if UTF-8 fails; it maps every byte, so it cannot fail
+        text = data.decode('latin-1')
+    
+    # Translate newlines as text mode would
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
 
 def extract_text_from_pdf(file_path):
     """Extract text from a PDF file using PyPDF2"""
@@ -92,18 +103,19 @@ def extract_text_from_pdf(file_path):
         return f"[PDF text extraction not available. Install PyPDF2 for full support: {os.path.basename(file_path)}]"
     
     try:
-        text = []
         with open(file_path, 'rb') as file:
             pdf_reader = PyPDF2.PdfReader(file)
-            for page_num in range(len(pdf_reader.pages)):
-                page = pdf_reader.pages[page_num]
-                text.append(page.extract_text())
-        
-        return "\n\n".join(text)
+            # Image-only pages can yield no text
+            return "\n\n".join(page.extract_text() or "" for page in pdf_reader.pages)
     except Exception as e:
         logger.error(f"Error extracting text from PDF: {str(e)}")
         return f"[Error extracting text from PDF: {str(e)}]"
 
+# Text-bearing children of the paragraph's own runs, in document order. Only direct
+# runs count, as in python-docx's Paragraph.text: nested runs belong to text boxes
+# (repeated under mc:Choice and mc:Fallback), and w:tab under w:pPr is a tab stop.
+_DOCX_RUN_TEXT_XPATH = './w:r/w:t | ./w:r/w:tab | ./w:r/w:br | ./w:r/w:cr'
+
 def extract_text_from_docx(file_path):
     """Extract text from a DOCX file using python-docx"""
     if not DOCX_SUPPORT:
@@ -111,6 +123,18 @@ def extract_text_from_docx(file_path):
     
     try:
         doc = docx.Document(file_path)
+    except Exception as e:
+        logger.error(f"Error extracting text from DOCX: {str(e)}")
+        return f"[Error extracting text from DOCX: {str(e)}]"
+    
+    # Walk the document XML directly; python-docx's Paragraph/Table wrappers
+    # cost an object per paragraph, run, row and cell on large documents
+    try:
+        return _extract_text_from_docx_xml(doc.element.body)
+    except Exception as e:
+        logger.warning(f"Falling back to the python-docx object model for DOCX text: {str(e)}")
+    
+    try:
         full_text = []
         
         # Extract text from paragraphs
@@ -130,13 +154,164 @@ def extract_text_from_docx(file_path):
         logger.error(f"Error extracting text from DOCX: {str(e)}")
         return f"[Error extracting text from DOCX: {str(e)}]"
 
-def extract_text_from_folder(folder_path, max_chars=None):
+def _docx_paragraph_text(paragraph):
+    """Text of a <w:p> element, with tabs and breaks rendered as python-docx does"""
+    parts = []
+    for node in paragraph.xpath(_DOCX_RUN_TEXT_XPATH):
+        if node.tag == _W_T:
+            parts.append(node.text or "")
+        elif node.tag == _W_TAB:
+            parts.append("\t")
+        else:
+            parts.append("\n")
+    return "".join(parts)
+
+def _docx_table_rows(tbl):
+    """
+    Cell texts of each row of a <w:tbl> element, laid out on the table grid like python-docx's row.cells
+    
+    A cell spanning several grid columns is repeated once per column, and a
+    vertically merged cell repeats the text of the cell above it.
+    """
+    column_count = len(tbl.tblGrid.gridCol_lst)
+    cells = []
+    for tc in tbl.iter_tcs():
+        text = "\n".join(_docx_paragraph_text(p) for p in tc.xpath('./w:p'))
+        for grid_span_index in range(tc.grid_span):
+            if tc.vMerge == ST_Merge.CONTINUE:
+                cells.append(cells[-column_count])
+            elif grid_span_index > 0:
+                cells.append(cells[-1])
+            else:
+                cells.append(text)
+    
+    for row_index in range(len(tbl.tr_lst)):
+        yield cells[row_index * column_count:(row_index + 1) * column_count]
+
+def _extract_text_from_docx_xml(body):
+    """
+    Extract paragraph and table text from a DOCX <w:body> element
+    
+    Produces the same text as the object-model path: body paragraphs first,
+    then one " | "-separated line per table row.
+    """
+    full_text = [_docx_paragraph_text(p) for p in body.xpath('./w:p')]
+    
+    for tbl in body.xpath('./w:tbl'):
+        for row_cells in _docx_table_rows(tbl):
+            full_text.append(" | ".join(row_cells))
+    
+    return "\n\n".join(full_text)
+
+def file_sha256(file_path, chunk_size=64 * 1024):
+    """
+    Hash a file's contents without reading it into memory at once
+    
+    Args:
+        file_path (str): Path to the file
+        chunk_size (int): Bytes to read at a time
+        
+    Returns:
+        str: Hex SHA-256 digest
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _parsed_extensions():
+    """Extensions whose extraction produces document text rather than a placeholder message"""
+    extensions = {'.txt'}
+    if PDF_SUPPORT:
+        extensions.add('.pdf')
+    if DOCX_SUPPORT:
+        extensions.add('.docx')
+    return extensions
+
+def extract_text_from_file_disk_cached(file_path, text_cache_folder):
+    """
+    Extract text from a file, keeping the result on disk keyed by the file's content hash and extension
+    
+    The same document uploaded again (by any session) is then never parsed twice.
+    The extension is part of the key because it decides how the bytes are parsed.
+    Extraction errors and placeholder messages (unsupported or unparseable types,
+    which name the file) are returned but not cached.
+    
+    Args:
+        file_path (str): Path to the file
+        text_cache_folder (str): Folder holding <sha256><ext>.txt extraction results
+        
+    Returns:
+        str: Extracted text or error message
+    """
+    file_extension = os.path.splitext(file_path)[1].lower()
+    if file_extension not in _parsed_extensions():
+        return extract_text_from_file(file_path)
+    
+    try:
+        cache_path = os.path.join(text_cache_folder, file_sha256(file_path) + file_extension + '.txt')
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Could not read text cache for {file_path}: {str(e)}")
+        return extract_text_from_file(file_path)
+    
+    text = extract_text_from_file(file_path)
+    if text.startswith('[Error'):
+        return text
+    
+    # Write to a temporary name and rename, so readers never see a partial file
+    try:
+        os.makedirs(text_cache_folder, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=text_cache_folder, prefix='.tmp-')
+        with open(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.warning(f"Could not write text cache for {file_path}: {str(e)}")
+    
+    return text
+
+@lru_cache(maxsize=256)
+def _extract_text_cached(file_path, mtime_ns, size, text_cache_folder=None):
+    """
+    Extract text from a file, memoized on its path, modification time and size
+
+    Re-uploading a file changes its mtime/size, so stale entries are never hit.
+    """
+    if text_cache_folder:
+        return extract_text_from_file_disk_cached(file_path, text_cache_folder)
+    return extract_text_from_file(file_path)
+
+def extract_text_from_file_cached(file_path, text_cache_folder=None):
+    """
+    Extract text from a file, reusing the previous result if the file is unchanged
+    
+    Args:
+        file_path (str): Path to the file
+        text_cache_folder (str, optional): Folder for content-addressed extraction results,
+            shared across processes and restarts
+        
+    Returns:
+        str: Extracted text or error message
+    """
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return extract_text_from_file(file_path)
+    return _extract_text_cached(file_path, stat.st_mtime_ns, stat.st_size, text_cache_folder)
+
+def extract_text_from_folder(folder_path, max_chars=None, text_cache_folder=None):
     """
     Extract text from all supported files in a folder
     
     Args:
         folder_path (str): Path to the folder containing files
         max_chars (int, optional): Maximum number of characters to extract
+        text_cache_folder (str, optional): Folder for content-addressed extraction results
         
     Returns:
         str: Concatenated text from all files
@@ -145,39 +320,80 @@ def extract_text_from_folder(folder_path, max_chars=None):
         logger.warning(f"Folder not found: {folder_path}")
         return ""
     
-    all_text = []
-    total_chars = 0
+    with os.scandir(folder_path) as entries:
+        # Sort by name so the combined text is the same whatever order the filesystem lists files in
+        file_entries = sorted((entry for entry in entries if not entry.is_dir(follow_symlinks=False)),
+                              key=lambda entry: entry.name)
     
-    for filename in os.listdir(folder_path):
-        file_path = os.path.join(folder_path, filename)
+    filenames = []
+    file_paths = []
+    mtimes = []
+    sizes = []
+    min_chars = 0  # lower bound on the joined text length so far
+    for entry in file_entries:
+        # Once the files already queued are certain to fill max_chars, the rest
+        # would be cut off entirely, so don't parse them
+        if max_chars and min_chars > max_chars:
+            logger.info(f"Skipping {len(file_entries) - len(file_paths)} files past the {max_chars} character limit")
+            break
         
-        # Skip directories
-        if os.path.isdir(file_path):
+        # Reuse the directory entry's stat as the memoization key instead of
+        # stat-ing every file again in extract_text_from_file_cached
+        try:
+            stat = entry.stat()
+        except OSError:
             continue
+        filenames.append(entry.name)
+        file_paths.append(entry.path)
+        mtimes.append(stat.st_mtime_ns)
+        sizes.append(stat.st_size)
         
-        # Extract text from the file
-        file_text = extract_text_from_file(file_path)
+        # Separator and header are exact; UTF-8 text has at least one character per 4 bytes
+        min_chars += (2 if len(file_paths) > 1 else 0) + len(f"--- From {entry.name} ---\n")
+        if entry.name.lower().endswith('.txt'):
+            min_chars += stat.st_size // 4
+    
+    text_cache_folders = [text_cache_folder] * len(file_paths)
+    
+    # Extract files in parallel, on OS threads even under gevent (see native_thread_pool).
+    # map() keeps results in submission order so the output is deterministic.
+    if len(file_paths) > 1:
+        with native_thread_pool(max_workers=min(len(file_paths), os.cpu_count() or 1)) as executor:
+            file_texts = list(executor.map(_extract_text_cached, file_paths, mtimes, sizes, text_cache_folders))
+    else:
+        file_texts = list(map(_extract_text_cached, file_paths, mtimes, sizes, text_cache_folders))
+    
+    all_text = []
+    total_chars = 0  # length of the joined text so far, separators included
+    truncated = False
+    
+    for filename, file_text in zip(filenames, file_texts):
         file_size = len(file_text)
         
         logger.info(f"Extracted {file_size} characters from {filename}")
         
         # Add a header with the filename
         formatted_text = f"--- From {filename} ---\n{file_text}"
-        all_text.append(formatted_text)
+        separator = 2 if all_text else 0  # "\n\n" between files
         
-        total_chars += len(formatted_text)
-        
-        # Check if we've exceeded the maximum size
-        if max_chars and total_chars > max_chars:
-            logger.warning(f"Truncating extracted text at {max_chars} characters (current: {total_chars})")
+        # Stop at the limit, keeping only the part of this file that still fits
+        if max_chars and total_chars + separator + len(formatted_text) > max_chars:
+            logger.warning(f"Truncating extracted text at {max_chars} characters")
+            remaining = max_chars - total_chars - separator
+            if remaining > 0:
+                all_text.append(formatted_text[:remaining])
+            else:
+                # Only the separator, or part of it, fits
+                all_text[-1] += "\n" * (separator + remaining)
+            truncated = True
             break
+        
+        all_text.append(formatted_text)
+        total_chars += separator + len(formatted_text)
     
     combined_text = "\n\n".join(all_text)
-    
-    # Truncate if necessary
-    if max_chars and len(combined_text) > max_chars:
-        logger.warning(f"Truncating final combined text from {len(combined_text)} to {max_chars} characters")
-        combined_text = combined_text[:max_chars] + "\n\n[Text truncated due to size limits]"
+    if truncated:
+        combined_text += "\n\n[Text truncated due to size limits]"
     
     logger.info(f"Total extracted text size: {len(combined_text)} characters from {len(all_text)} files")
     return combined_text
@@ -207,15 +423,17 @@ def get_folder_size(folder_path):
     
     return total_size
 
-def create_docx_from_text(text):
+def create_docx_from_text(text, output=None):
     """
     Create a DOCX file from text content
     
     Args:
         text (str): Text content to convert to DOCX
+        output (file-like, optional): Binary stream to write the DOCX into. Defaults to a
+            temporary file that stays in memory up to 1MB and spills to disk beyond that.
         
     Returns:
-        BytesIO: BytesIO object containing the DOCX file
+        file-like: The output stream containing the DOCX file, rewound to the start
     """
     if not DOCX_SUPPORT:
         logger.error("python-docx not installed. Cannot create DOCX file.")
@@ -231,12 +449,13 @@ def create_docx_from_text(text):
             if para.strip():  # Skip empty paragraphs
                 doc.add_paragraph(para)
         
-        # Save the document to a BytesIO object
-        docx_bytes = io.BytesIO()
-        doc.save(docx_bytes)
-        docx_bytes.seek(0)
+        # Save the document to the output stream
+        if output is None:
+            output = tempfile.SpooledTemporaryFile(max_size=1 << 20)
+        doc.save(output)
+        output.seek(0)
         
-        return docx_bytes
+        return output
     except Exception as e:
         logger.error(f"Error creating DOCX file: {str(e)}")
         return None
@@ -0,0 +1,42 @@
+import orjson
+from flask.json.provider import DefaultJSONProvider
+
+class ORJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider that serializes with orjson
+    
+    Types orjson doesn't handle natively fall back to Flask's default
+    conversions, and datetimes are passed through so they keep Flask's
+    HTTP date format.
+    """
+
+    def dumps(self, obj, **kwargs):
+        """
+        Serialize data as a JSON string
+        
+        Args:
+            obj: The data to serialize
+            **kwargs: Accepts ``indent`` (pretty-printed with two spaces); other
+                stdlib json arguments are ignored
+            
+        Returns:
+            str: The JSON document
+        """
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        """
+        Deserialize data from a JSON string or bytes
+        
+        Args:
+            s (str or bytes): The JSON document
+            
+        Returns:
+            The deserialized data
+        """
+        return orjson.loads(s)
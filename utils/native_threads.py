@@ -0,0 +1,35 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# gevent is only used in production (wsgi.py monkey-patches the standard library),
+# so don't fail if it's not available
+try:
+    from gevent import monkey
+    from gevent.threadpool import ThreadPoolExecutor as GeventThreadPoolExecutor
+    GEVENT_SUPPORT = True
+except ImportError:
+    GEVENT_SUPPORT = False
+
+def native_thread_pool(max_workers, thread_name_prefix=''):
+    """
+    Create a thread pool whose workers are OS threads, even under gevent monkey-patching
+
+    Once threading is monkey-patched, a plain ThreadPoolExecutor runs its workers as
+    greenlets on the worker's single OS thread. CPU-bound work such as PyPDF2 parsing
+    then runs one file at a time and stalls every other request on that worker,
+    including in-flight SSE streams. gevent's ThreadPoolExecutor runs tasks on real
+    threads, and waiting on its futures yields to other greenlets.
+
+    Args:
+        max_workers (int): Maximum number of worker threads
+        thread_name_prefix (str): Name prefix for the threads (ignored under gevent)
+
+    Returns:
+        concurrent.futures.Executor: The executor
+    """
+    if GEVENT_SUPPORT and monkey.is_module_patched('threading'):
+        return GeventThreadPoolExecutor(max_workers)
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
@@ -1,8 +1,29 @@
+import re
+import codecs
 import logging
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from types import MappingProxyType
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# Try to import a BPE tokenizer for token counting, but fall back to a
+# character-based estimate if it's not available
+try:
+    import tiktoken
+    TIKTOKEN_SUPPORT = True
+except ImportError:
+    TIKTOKEN_SUPPORT = False
+    logger.warning("tiktoken not installed. Token counts will be estimated from character length.")
+
+# Token counts of recently seen texts, keyed by content digest
+TOKEN_COUNT_CACHE_SIZE = 512
+_token_count_cache = OrderedDict()
+_token_count_lock = threading.Lock()
+
 # Format definitions
 FORMAT_DETAILS = {
     'speech_15min': {
@@ -42,6 +63,9 @@ FORMAT_DETAILS = {
     }
 }
 
+# Freeze the entries: get_format_details hands out the shared objects
+FORMAT_DETAILS = {format_type: MappingProxyType(details) for format_type, details in FORMAT_DETAILS.items()}
+
 def map_tone(formality_level=None, confidence_level=None, region=None, persona=None, industry=None):
     """
     Build a concise tone/persona directive string based on numeric sliders and selections.
@@ -94,10 +118,10 @@ def get_format_details(format_type, custom_word_count=None):
         custom_word_count (int, optional): Custom word count for 'custom' format
         
     Returns:
-        dict: Format details including description, word count, and characteristics
+        Mapping: Format details including description, word count, and characteristics
+        (read-only unless a custom word count was applied)
     """
-    # Get the format details or default to custom if not found
-    format_info = FORMAT_DETAILS.get(format_type, FORMAT_DETAILS['custom'])
+    format_info = _get_format_details_static(format_type)
     
     # If it's a custom format and a word count is provided, update the word count
     if format_type == 'custom' and custom_word_count is not None:
@@ -110,6 +134,11 @@ def get_format_details(format_type, custom_word_count=None):
     
     return format_info
 
+@lru_cache(maxsize=16)
+def _get_format_details_static(format_type):
+    """Get the details for a format type, or the custom format if it is unknown"""
+    return FORMAT_DETAILS.get(format_type, FORMAT_DETAILS['custom'])
+
 def construct_prompt(
     brief,
     format_type,
@@ -154,22 +183,112 @@ def construct_prompt(
     format_info = get_format_details(format_type, custom_word_count)
     
     # Construct the prompt
-    if format_type == 'linkedin':
-        prompt = f"""You are an expert communications professional tasked with writing a {format_info['description']} (approximately {format_info['word_count']} characters) that is {format_info['characteristics']}.
+    prompt = "".join((
+        _build_prompt_header(brief, format_type, format_info, audience, objective, key_messages,
+                             constraints, tone_formality, tone_confidence, region, industry, persona),
+        _build_materials_section(style_text, past_text, competitive_text),
+        _build_final_instructions(format_type, format_info),
+    ))
+    
+    logger.info(f"Constructed prompt for {format_info['description']} with {len(prompt)} characters")
+    
+    return prompt
 
-BRIEF:
-{brief}
+def construct_prompt_parts(
+    brief,
+    format_type,
+    style_text=None,
+    past_text=None,
+    competitive_text=None,
+    custom_word_count=None,
+    audience=None,
+    objective=None,
+    key_messages=None,
+    constraints=None,
+    tone_formality=None,
+    tone_confidence=None,
+    region=None,
+    industry=None,
+    persona=None
+):
+    """
+    Construct the prompt as a cacheable system prompt plus a user message
+    
+    The source material rarely changes between generations in a session, so it
+    goes in a system block marked for prompt caching, and the brief, structured
+    details and format instructions go in the user message.
+    
+    Args:
+        Same as construct_prompt
+        
+    Returns:
+        tuple: (list, str) - System content blocks (empty if there is no source
+        material) and the user message text
+    """
+    format_info = get_format_details(format_type, custom_word_count)
+    
+    system_blocks = []
+    materials = _build_materials_section(style_text, past_text, competitive_text)
+    if materials:
+        system_blocks.append({
+            'type': 'text',
+            'text': materials,
+            'cache_control': {'type': 'ephemeral'}
+        })
+    
+    user_message = "".join((
+        _build_prompt_header(brief, format_type, format_info, audience, objective, key_messages,
+                             constraints, tone_formality, tone_confidence, region, industry, persona),
+        _build_final_instructions(format_type, format_info),
+    ))
+    
+    logger.info(f"Constructed prompt for {format_info['description']} with {len(materials)} cacheable system "
+                f"and {len(user_message)} user message characters")
+    
+    return system_blocks, user_message
 
-"""
-    else:
-        prompt = f"""You are an expert communications professional tasked with writing a {format_info['description']} (approximately {format_info['word_count']} words) that is {format_info['characteristics']}.
+# Templates for the opening and closing of the prompt; {unit} is "characters" for LinkedIn posts and "words" otherwise
+_PROMPT_HEADER_TEMPLATE = """You are an expert communications professional tasked with writing a {description} (approximately {word_count} {unit}) that is {characteristics}.
 
 BRIEF:
 {brief}
 
 """
+_FINAL_INSTRUCTIONS_TEMPLATE = """
+Please write a {description} based on the brief provided, using the substance from the source material, emulating the writing style from the past examples, and drawing inspiration from the competitive examples. The content should be approximately {word_count} {unit} and should be {characteristics}.
+
+Format your response as a complete, ready-to-use document without explanations or meta-commentary.
+"""
+
+def _length_unit(format_type):
+    """Unit the format's word_count is measured in"""
+    return 'characters' if format_type == 'linkedin' else 'words'
+
+def _build_prompt_header(brief, format_type, format_info, audience=None, objective=None, key_messages=None,
+                         constraints=None, tone_formality=None, tone_confidence=None, region=None,
+                         industry=None, persona=None):
+    """Build the role, brief and structured brief details section of the prompt"""
+    prompt = _PROMPT_HEADER_TEMPLATE.format(
+        description=format_info['description'],
+        word_count=format_info['word_count'],
+        unit=_length_unit(format_type),
+        characteristics=format_info['characteristics'],
+        brief=brief
+    )
     
     # Add structured brief details if provided
+    return prompt + _render_brief_details(audience, objective, key_messages, constraints, tone_formality,
+                                          tone_confidence, region, industry, persona)
+
+@lru_cache(maxsize=512)
+def _render_brief_details(audience=None, objective=None, key_messages=None, constraints=None,
+                          tone_formality=None, tone_confidence=None, region=None, industry=None, persona=None):
+    """
+    Render the BRIEF DETAILS section, memoized since the fields rarely change between generations
+    
+    Returns:
+        str: The section text, or an empty string if no details were given
+    """
     brief_details = []
     if audience:
         brief_details.append(f"- Audience: {audience}")
@@ -184,65 +303,118 @@ BRIEF:
     if tone_directive:
         brief_details.append(f"- Tone/persona guidance: {tone_directive}")
 
-    if brief_details:
-        details_text = "\n".join(brief_details)
-        prompt += f"""
+    if not brief_details:
+        return ""
+
+    details_text = "\n".join(brief_details)
+    return f"""
 BRIEF DETAILS:
 {details_text}
 
 """
 
-    # Add source material if available
-    if style_text:
-        prompt += f"""
+# Static headings of the source material sections, each followed by the section text and a blank line
+_SOURCE_MATERIAL_HEADING = """
 SOURCE MATERIAL:
 The following material provides the substance of the content - relevant data and information that should be included in your response:
 
-{style_text}
-
 """
-    
-    # Add past examples if available
-    if past_text:
-        prompt += f"""
+_PAST_EXAMPLES_HEADING = """
 PAST EXAMPLES:
 The following examples demonstrate the desired writing style, tone, format, and flow. Please emulate this style in your response:
 
-{past_text}
-
 """
-    
-    # Add competitive examples if available
-    if competitive_text:
-        prompt += f"""
+_COMPETITIVE_EXAMPLES_HEADING = """
 COMPETITIVE EXAMPLES:
 The following are examples from competitors or similar organizations. Draw inspiration from these while maintaining originality:
 
-{competitive_text}
-
 """
+_SECTION_END = "\n\n"
+
+def _build_materials_section(style_text=None, past_text=None, competitive_text=None):
+    """Build the source material, past example and competitive example sections of the prompt"""
+    parts = []
+
+    # Add source material if available
+    if style_text:
+        parts += (_SOURCE_MATERIAL_HEADING, style_text, _SECTION_END)
+    
+    # Add past examples if available
+    if past_text:
+        parts += (_PAST_EXAMPLES_HEADING, past_text, _SECTION_END)
     
-    # Final instructions
-    if format_type == 'linkedin':
-        prompt += f"""
-Please write a {format_info['description']} based on the brief provided, using the substance from the source material, emulating the writing style from the past examples, and drawing inspiration from the competitive examples. The content should be approximately {format_info['word_count']} characters and should be {format_info['characteristics']}.
+    # Add competitive examples if available
+    if competitive_text:
+        parts += (_COMPETITIVE_EXAMPLES_HEADING, competitive_text, _SECTION_END)
 
-Format your response as a complete, ready-to-use document without explanations or meta-commentary.
-"""
-    else:
-        prompt += f"""
-Please write a {format_info['description']} based on the brief provided, using the substance from the source material, emulating the writing style from the past examples, and drawing inspiration from the competitive examples. The content should be approximately {format_info['word_count']} words and should be {format_info['characteristics']}.
+    return "".join(parts)
 
-Format your response as a complete, ready-to-use document without explanations or meta-commentary.
-"""
+def _build_final_instructions(format_type, format_info):
+    """Build the closing instructions of the prompt"""
+    return _FINAL_INSTRUCTIONS_TEMPLATE.format(
+        description=format_info['description'],
+        word_count=format_info['word_count'],
+        unit=_length_unit(format_type),
+        characteristics=format_info['characteristics']
+    )
+
+@lru_cache(maxsize=1)
+def get_tokenizer():
+    """
+    Load the BPE tokenizer once per process
     
-    logger.info(f"Constructed prompt for {format_info['description']} with {len(prompt)} characters")
+    Returns:
+        tiktoken.Encoding: The tokenizer, or None if it is unavailable
+    """
+    if not TIKTOKEN_SUPPORT:
+        return None
     
-    return prompt
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning(f"Could not load tokenizer, estimating token counts instead: {str(e)}")
+        return None
+
+def text_digest(text):
+    """
+    Compute a short content digest for a text
+    
+    Args:
+        text (str): The text to hash
+        
+    Returns:
+        str: Hex digest of the text
+    """
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+# A very rough approximation used without a tokenizer: 1 token ≈ 4 characters for English text
+_CHARS_PER_TOKEN = 4
+
+def _estimate_from_length(text):
+    """Estimate a token count without a tokenizer"""
+    return len(text) // _CHARS_PER_TOKEN
+
+def _cached_token_count(digest):
+    """Look up a previously computed token count by content digest, or None"""
+    with _token_count_lock:
+        token_count = _token_count_cache.get(digest)
+        if token_count is not None:
+            _token_count_cache.move_to_end(digest)
+    return token_count
+
+def _remember_token_count(digest, token_count):
+    """Cache a token count by content digest, evicting the least recently used entry"""
+    with _token_count_lock:
+        _token_count_cache[digest] = token_count
+        if len(_token_count_cache) > TOKEN_COUNT_CACHE_SIZE:
+            _token_count_cache.popitem(last=False)
 
 def estimate_token_count(text):
     """
-    Estimate the number of tokens in a text (rough approximation)
+    Estimate the number of tokens in a text
+    
+    Uses the BPE tokenizer when available, caching counts by content digest so
+    unchanged source material is not re-tokenized on every generation.
     
     Args:
         text (str): The text to estimate tokens for
@@ -252,10 +424,16 @@ def estimate_token_count(text):
     """
     if not text:
         return 0
-        
-    # A very rough approximation: 1 token ≈ 4 characters for English text
-    # This is a simple heuristic - in production, consider using a proper tokenizer
-    estimated_tokens = len(text) // 4
+    
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        estimated_tokens = _estimate_from_length(text)
+    else:
+        digest = text_digest(text)
+        estimated_tokens = _cached_token_count(digest)
+        if estimated_tokens is None:
+            estimated_tokens = len(tokenizer.encode(text, disallowed_special=()))
+            _remember_token_count(digest, estimated_tokens)
     
     # Log token estimates for large texts
     if len(text) > 10000:
@@ -263,6 +441,45 @@ def estimate_token_count(text):
         
     return estimated_tokens
 
+_PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+_WHITESPACE_RUN = re.compile(r'\s+')
+_SOURCE_HEADER = re.compile(r'^--- From .* ---\n')  # added per file by extract_text_from_folder
+
+def dedupe_paragraphs(text, min_length=40):
+    """
+    Drop repeated paragraphs from source material, keeping the first occurrence
+    
+    Paragraphs are compared with whitespace collapsed, so re-uploaded drafts that
+    differ only in line wrapping still count as duplicates. Paragraphs shorter than
+    min_length (headings, sign-offs) and per-file source headers are always kept.
+    
+    Args:
+        text (str): The text to deduplicate
+        min_length (int): Minimum normalized length for a paragraph to be deduplicated
+        
+    Returns:
+        str: Text with duplicate paragraphs removed, paragraphs separated by blank lines
+    """
+    if not text:
+        return text
+    
+    seen = set()
+    kept = []
+    for paragraph in _PARAGRAPH_BREAK.split(text):
+        header = _SOURCE_HEADER.match(paragraph)
+        body = paragraph[header.end():] if header else paragraph
+        normalized = _WHITESPACE_RUN.sub(' ', body).strip()
+        if len(normalized) >= min_length:
+            if normalized in seen:
+                if header:
+                    kept.append(header.group().strip())
+                continue
+            seen.add(normalized)
+        if paragraph.strip():
+            kept.append(paragraph.strip())
+    
+    return "\n\n".join(kept)
+
 def truncate_text_to_fit(text, max_tokens, section_name):
     """
     Truncate text to fit within token limits
@@ -277,8 +494,19 @@ def truncate_text_to_fit(text, max_tokens, section_name):
     """
     if not text:
         return ""
-        
-    estimated_tokens = estimate_token_count(text)
+    
+    tokenizer = get_tokenizer()
+    token_ids = None
+    if tokenizer is None:
+        estimated_tokens = estimate_token_count(text)
+    else:
+        # Count with the ids themselves so a text that needs cutting is only encoded once
+        digest = text_digest(text)
+        estimated_tokens = _cached_token_count(digest)
+        if estimated_tokens is None:
+            token_ids = tokenizer.encode(text, disallowed_special=())
+            estimated_tokens = len(token_ids)
+            _remember_token_count(digest, estimated_tokens)
     
     if estimated_tokens <= max_tokens:
         logger.info(f"{section_name} fits within token limits: {estimated_tokens}/{max_tokens} tokens")
@@ -286,16 +514,41 @@ def truncate_text_to_fit(text, max_tokens, section_name):
     
     # Simple truncation strategy - keep the beginning and add a note
     # A more sophisticated approach would be to extract key sections or summarize
-    chars_to_keep = max_tokens * 4  # Convert tokens back to approximate characters
-    truncated_text = text[:chars_to_keep]
+    if tokenizer is not None:
+        # Cut on token ids so the kept text is exactly max_tokens long
+        if token_ids is None:
+            token_ids = tokenizer.encode(text, disallowed_special=())
+        truncated_bytes = tokenizer.decode_bytes(token_ids[:max(max_tokens, 0)])
+        # A token boundary can fall inside a multi-byte character; the incremental
+        # decoder holds back that trailing partial character instead of emitting U+FFFD
+        truncated_text = codecs.getincrementaldecoder('utf-8')(errors='replace').decode(truncated_bytes)
+    else:
+        truncated_text = text[:_longest_prefix_within(text, max_tokens)]
     
     # Add a note about truncation
     truncation_note = f"\n\n[Note: The {section_name} content was truncated from {estimated_tokens} to {max_tokens} tokens to fit within limits.]"
     
-    logger.warning(f"Truncated {section_name} from {estimated_tokens} to {max_tokens} tokens ({len(text)} to {chars_to_keep} characters)")
+    logger.warning(f"Truncated {section_name} from {estimated_tokens} to {max_tokens} tokens ({len(text)} to {len(truncated_text)} characters)")
     
     return truncated_text + truncation_note
 
+def _longest_prefix_within(text, max_tokens):
+    """
+    Length of the longest prefix of text whose length-based token estimate fits max_tokens
+    
+    Used when no tokenizer is available. The estimate is len // _CHARS_PER_TOKEN
+    (see _estimate_from_length), so the answer has a closed form: every prefix
+    shorter than (max_tokens + 1) * _CHARS_PER_TOKEN fits.
+    
+    Args:
+        text (str): The text to cut
+        max_tokens (int): Maximum number of tokens
+        
+    Returns:
+        int: Length in characters of the longest fitting prefix
+    """
+    return min(len(text), max((max_tokens + 1) * _CHARS_PER_TOKEN - 1, 0))
+
 def optimize_prompt_for_token_limits(brief, format_type, style_text=None, past_text=None, competitive_text=None,
                                     custom_word_count=None, max_total_tokens=8000,
                                     audience=None, objective=None, key_messages=None, constraints=None,
@@ -315,6 +568,79 @@ def optimize_prompt_for_token_limits(brief, format_type, style_text=None, past_t
     Returns:
         str: The optimized prompt
     """
+    optimized_style_text, optimized_past_text, optimized_competitive_text = fit_examples_to_token_limits(
+        brief, style_text, past_text, competitive_text, max_total_tokens
+    )
+    
+    # Construct the optimized prompt
+    return construct_prompt(
+        brief, 
+        format_type, 
+        optimized_style_text, 
+        optimized_past_text, 
+        optimized_competitive_text, 
+        custom_word_count,
+        audience=audience,
+        objective=objective,
+        key_messages=key_messages,
+        constraints=constraints,
+        tone_formality=tone_formality,
+        tone_confidence=tone_confidence,
+        region=region,
+        industry=industry,
+        persona=persona
+    )
+
+def optimize_prompt_parts_for_token_limits(brief, format_type, style_text=None, past_text=None, competitive_text=None,
+                                           custom_word_count=None, max_total_tokens=8000,
+                                           audience=None, objective=None, key_messages=None, constraints=None,
+                                           tone_formality=None, tone_confidence=None, region=None, industry=None,
+                                           persona=None):
+    """
+    Optimize the prompt to fit within token limits, split for prompt caching
+    
+    Args:
+        Same as optimize_prompt_for_token_limits
+        
+    Returns:
+        tuple: (list, str) - System content blocks and user message, see construct_prompt_parts
+    """
+    optimized_style_text, optimized_past_text, optimized_competitive_text = fit_examples_to_token_limits(
+        brief, style_text, past_text, competitive_text, max_total_tokens
+    )
+    
+    return construct_prompt_parts(
+        brief,
+        format_type,
+        optimized_style_text,
+        optimized_past_text,
+        optimized_competitive_text,
+        custom_word_count,
+        audience=audience,
+        objective=objective,
+        key_messages=key_messages,
+        constraints=constraints,
+        tone_formality=tone_formality,
+        tone_confidence=tone_confidence,
+        region=region,
+        industry=industry,
+        persona=persona
+    )
+
+def fit_examples_to_token_limits(brief, style_text=None, past_text=None, competitive_text=None, max_total_tokens=8000):
+    """
+    Allocate the token budget left after the brief across the example texts and truncate them to fit
+    
+    Args:
+        brief (str): The writing brief
+        style_text (str, optional): Text from style examples
+        past_text (str, optional): Text from past examples
+        competitive_text (str, optional): Text from competitive examples
+        max_total_tokens (int): Maximum total tokens for the prompt
+        
+    Returns:
+        tuple: (style_text, past_text, competitive_text) truncated to their token budgets
+    """
     # Log initial sizes
     logger.info(f"Optimizing prompt for token limits (max: {max_total_tokens})")
     logger.info(f"Initial sizes - Brief: {len(brief)} chars, Style: {len(style_text or '')} chars, " +
@@ -332,67 +658,22 @@ def optimize_prompt_for_token_limits(brief, format_type, style_text=None, past_t
     remaining_tokens = max_total_tokens - structure_tokens - brief_tokens
     logger.info(f"Remaining tokens for examples: {remaining_tokens}")
     
-    # If we have all three types of examples, allocate tokens proportionally
-    if style_text and past_text and competitive_text:
-        style_tokens = remaining_tokens // 3
-        past_tokens = remaining_tokens // 3
-        competitive_tokens = remaining_tokens - style_tokens - past_tokens
-    
-    # If we have two types of examples, split remaining tokens
-    elif style_text and past_text:
-        style_tokens = remaining_tokens // 2
-        past_tokens = remaining_tokens - style_tokens
-        competitive_tokens = 0
-    elif style_text and competitive_text:
-        style_tokens = remaining_tokens // 2
-        past_tokens = 0
-        competitive_tokens = remaining_tokens - style_tokens
-    elif past_text and competitive_text:
-        style_tokens = 0
-        past_tokens = remaining_tokens // 2
-        competitive_tokens = remaining_tokens - past_tokens
-    
-    # If we have only one type of example, allocate all remaining tokens
-    elif style_text:
-        style_tokens = remaining_tokens
-        past_tokens = 0
-        competitive_tokens = 0
-    elif past_text:
-        style_tokens = 0
-        past_tokens = remaining_tokens
-        competitive_tokens = 0
-    elif competitive_text:
-        style_tokens = 0
-        past_tokens = 0
-        competitive_tokens = remaining_tokens
-    
-    # If we have no examples, no need to allocate tokens
-    else:
-        style_tokens = 0
-        past_tokens = 0
-        competitive_tokens = 0
+    # Split the remaining tokens evenly across the examples that were provided,
+    # giving any remainder to the last one
+    examples = [(section_name, text) for section_name, text in (
+        ("source material", style_text),
+        ("past examples", past_text),
+        ("competitive examples", competitive_text),
+    ) if text]
     
-    # Truncate texts if necessary
-    optimized_brief = brief
-    optimized_style_text = truncate_text_to_fit(style_text, style_tokens, "source material") if style_text else None
-    optimized_past_text = truncate_text_to_fit(past_text, past_tokens, "past examples") if past_text else None
-    optimized_competitive_text = truncate_text_to_fit(competitive_text, competitive_tokens, "competitive examples") if competitive_text else None
+    optimized = {}
+    for index, (section_name, text) in enumerate(examples):
+        section_tokens = remaining_tokens // len(examples)
+        if index == len(examples) - 1:
+            section_tokens = remaining_tokens - section_tokens * index
+        
+        # Truncate texts if necessary
+        optimized[section_name] = truncate_text_to_fit(text, section_tokens, section_name)
     
-    # Construct the optimized prompt
-    return construct_prompt(
-        optimized_brief, 
-        format_type, 
-        optimized_style_text, 
-        optimized_past_text, 
-        optimized_competitive_text, 
-        custom_word_count,
-        audience=audience,
-        objective=objective,
-        key_messages=key_messages,
-        constraints=constraints,
-        tone_formality=tone_formality,
-        tone_confidence=tone_confidence,
-        region=region,
-        industry=industry,
-        persona=persona
-    )
+    return (optimized.get("source material"), optimized.get("past examples"),
+            optimized.get("competitive examples"))
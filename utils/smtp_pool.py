@@ -0,0 +1,110 @@
+import smtplib
+import logging
+import threading
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+class SMTPConnectionPool:
+    """
+    Reusable, authenticated SMTP connections keyed by (host, port, user)
+
+    Connecting, upgrading to TLS and logging in takes seconds against most
+    providers, so connections are kept open between messages and checked with
+    NOOP before reuse. Each connection is used by one thread at a time.
+    """
+
+    def __init__(self, timeout=30):
+        """
+        Args:
+            timeout (float): Socket timeout in seconds for new connections
+        """
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._connections = {}  # (host, port, user) -> [server or None, lock]
+
+    def _entry(self, key):
+        with self._lock:
+            entry = self._connections.get(key)
+            if entry is None:
+                entry = self._connections[key] = [None, threading.Lock()]
+            return entry
+
+    def _connect(self, host, port, user, password):
+        server = smtplib.SMTP(host, port, timeout=self.timeout)
+        server.starttls()
+        server.login(user, password)
+        logger.info(f"Opened SMTP connection to {host}:{port}")
+        return server
+
+    @staticmethod
+    def _is_alive(server):
+        try:
+            return server.noop()[0] == 250
+        except smtplib.SMTPException:
+            return False
+        except OSError:
+            return False
+
+    @staticmethod
+    def _close(server):
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+    def get_server(self, host, port, user, password):
+        """
+        Get a live connection for the given account, reconnecting if needed
+
+        The caller must hold the connection's lock; use send() unless you need
+        the raw connection.
+
+        Args:
+            host (str): SMTP host
+            port (int): SMTP port
+            user (str): Login user
+            password (str): Login password
+
+        Returns:
+            smtplib.SMTP: Connected, authenticated server
+        """
+        entry = self._entry((host, port, user))
+        server = entry[0]
+        if server is None or not self._is_alive(server):
+            if server is not None:
+                self._close(server)
+            entry[0] = server = self._connect(host, port, user, password)
+        return server
+
+    def send(self, msg, host, port, user, password):
+        """
+        Send a message over a pooled connection
+
+        Args:
+            msg (email.message.EmailMessage): Message to send
+            host (str): SMTP host
+            port (int): SMTP port
+            user (str): Login user
+            password (str): Login password
+        """
+        entry = self._entry((host, port, user))
+        with entry[1]:
+            server = self.get_server(host, port, user, password)
+            try:
+                server.send_message(msg)
+            except smtplib.SMTPServerDisconnected:
+                # The server dropped us between NOOP and send; retry once
+                entry[0] = server = self._connect(host, port, user, password)
+                server.send_message(msg)
+
+    def close_all(self):
+        """Quit every pooled connection"""
+        with self._lock:
+            entries = list(self._connections.values())
+            self._connections.clear()
+        for entry in entries:
+            with entry[1]:
+                if entry[0] is not None:
+                    self._close(entry[0])
+                    entry[0] = None
@@ -0,0 +1,51 @@
+import time
+import threading
+from functools import wraps
+from collections import OrderedDict
+
+def ttl_cache(seconds=60, maxsize=128):
+    """
+    Cache a function's results for a fixed time, evicting least recently used entries
+
+    Arguments must be hashable. Cached results are shared between callers, so
+    they should not be mutated. The wrapped function gains a cache_clear() method.
+
+    Args:
+        seconds (float): How long a cached result stays valid
+        maxsize (int): Maximum number of cached results
+
+    Returns:
+        function: Decorator
+    """
+    def decorator(func):
+        cache = OrderedDict()  # key -> (expires_at, result)
+        lock = threading.Lock()
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            now = time.monotonic()
+
+            with lock:
+                entry = cache.get(key)
+                if entry is not None and entry[0] > now:
+                    cache.move_to_end(key)
+                    return entry[1]
+
+            result = func(*args, **kwargs)
+
+            with lock:
+                cache[key] = (now + seconds, result)
+                cache.move_to_end(key)
+                while len(cache) > maxsize:
+                    cache.popitem(last=False)
+            return result
+
+        def cache_clear():
+            with lock:
+                cache.clear()
+
+        wrapper.cache_clear = cache_clear
+        return wrapper
+
+    return decorator
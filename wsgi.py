@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+"""
+WSGI entry point for the Writing Assistant application.
+Used in production with gunicorn's gevent workers, e.g.:
+
+    gunicorn -k gevent -w 4 --worker-connections 200 --timeout 120 wsgi:app
+"""
+
+# Patch the standard library before anthropic/httpx are imported so that
+# in-flight Anthropic calls yield to other requests instead of blocking the worker.
+# Patched thread pools run greenlets, so CPU-bound text extraction uses
+# utils.native_threads.native_thread_pool to stay on OS threads.
+from gevent import monkey
+monkey.patch_all()
+
+from app import app  # noqa: E402
+
+if __name__ == '__main__':
+    app.run()